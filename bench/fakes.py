@@ -0,0 +1,326 @@
+# bench/fakes.py
+# Local stand-ins for the TMDB, Plex Media Server, plex.tv and Tautulli
+# endpoints this project calls, so benchmarks run offline and repeatably.
+#
+# Every server injects a fixed per-request *latency*, can enforce a *rate*
+# limit (answering 429 + Retry-After like TMDB does) and counts requests
+# per endpoint so a benchmark can report round trips next to timings.
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import quoteattr
+
+from requests.adapters import HTTPAdapter
+
+
+class _Bucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class FakeServer:
+    """Threaded HTTP server on an ephemeral localhost port.
+
+    Subclasses implement `route(method, path, query, body)` returning
+    `(status, content_type, bytes)` and `label(path)` for request counting.
+    """
+
+    def __init__(self, latency: float = 0.0, rate: Optional[float] = None):
+        self.latency = latency
+        self.bucket = _Bucket(rate) if rate else None
+        self.counts: Counter = Counter()
+        self.throttled = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True     # no delayed-ACK stalls on keep-alive
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+                with fake._lock:
+                    fake.counts[f"{self.command} {fake.label(url.path)}"] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.bucket and not fake.bucket.take():
+                    with fake._lock:
+                        fake.throttled += 1
+                    status, ctype, data = 429, "application/json", b'{"status_code": 25}'
+                else:
+                    status, ctype, data = fake.route(self.command, unquote(url.path), query, body)
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+            self.throttled = 0
+
+    def label(self, path: str) -> str:
+        return re.sub(r"/\d[\d,]*", "/{id}", path)
+
+    def route(self, method: str, path: str, query: dict, body: bytes):
+        raise NotImplementedError
+
+
+def _json(obj, status: int = 200):
+    return status, "application/json", json.dumps(obj).encode()
+
+
+def _xml(inner: str = "", status: int = 200, **attrs):
+    head = "".join(f" {k}={quoteattr(str(v))}" for k, v in attrs.items())
+    return status, "application/xml", f"<MediaContainer{head}>{inner}</MediaContainer>".encode()
+
+
+# --------------------------------------------------------------------------- #
+class FakeTMDB(FakeServer):
+    """`/movie/{id}`, `/tv/{id}` (append_to_response is pre-baked) and `/find/{id}`."""
+
+    def __init__(self, details: Dict[int, dict], **kw):
+        super().__init__(**kw)
+        self.details = details
+
+    def route(self, method, path, query, body):
+        m = re.fullmatch(r"/(movie|tv)/(\d+)", path)
+        if m and int(m.group(2)) in self.details:
+            return _json(self.details[int(m.group(2))])
+        if path.startswith("/find/"):
+            return _json({"tv_results": []})
+        return _json({"status_code": 34, "status_message": "not found"}, 404)
+
+
+# --------------------------------------------------------------------------- #
+class FakeTautulli(FakeServer):
+    """`/api/v2?cmd=get_users|get_history` for one user."""
+
+    def __init__(self, username: str, history: List[dict], **kw):
+        super().__init__(**kw)
+        self.username = username
+        self.history = history
+
+    def label(self, path):
+        return path
+
+    def route(self, method, path, query, body):
+        cmd = query.get("cmd")
+        if cmd == "get_users":
+            data = [{"username": self.username, "user_id": 1}]
+        elif cmd == "get_history":
+            start, length = int(query.get("start", 0)), int(query.get("length", 25))
+            data = {"data": self.history[start:start + length], "recordsTotal": len(self.history)}
+        else:
+            data = {}
+        return _json({"response": {"result": "success", "data": data}})
+
+
+# --------------------------------------------------------------------------- #
+class FakePlex(FakeServer):
+    """Plex Media Server with *sections* library sections (items dealt out
+    round-robin) plus the plex.tv account endpoints (served under
+    ``/plextv``; see `plextv_adapter`).
+
+    Collections are kept in memory so pushes behave like the real thing:
+    create, list children, batched add, per-item delete and move.
+    """
+
+    SECTION = {"movie": ("1", "Movies", "movie", 1, "Video"),
+               "tv": ("2", "TV Shows", "show", 2, "Directory")}
+
+    def __init__(self, items: List[dict], kind: str = "movie", username: str = "bench",
+                 sections: int = 1, **kw):
+        super().__init__(**kw)
+        self.kind = kind
+        self.username = username
+        key, self.title, self.type, self.type_id, self.tag = self.SECTION[kind]
+        self.keys = [str(int(key) + 10 * s) for s in range(sections)]
+        self.items = {it["rating_key"]: {**it, "section": self.keys[i % sections]}
+                      for i, it in enumerate(items)}
+        self.collections: Dict[int, dict] = {}
+        self._next_collection = 900_000
+        self._listing: Dict[str, bytes] = {}
+        self.changed_at = {key: max((it["updated_at"] for it in self._in(key)), default=0)
+                           for key in self.keys}
+
+    def _in(self, key: str) -> List[dict]:
+        return [it for it in self.items.values() if it["section"] == key]
+
+    def label(self, path):
+        if path.startswith("/library/sections/") and path.endswith("/all"):
+            return "/library/sections/{id}/all"
+        return super().label(path)
+
+    def _item_xml(self, it: dict) -> str:
+        guid = f"tmdb://{it['tmdb_id']}"
+        return (f"<{self.tag} ratingKey=\"{it['rating_key']}\" key=\"/library/metadata/{it['rating_key']}\" "
+                f"type=\"{self.type}\" title={quoteattr(it['title'])} guid=\"plex://{self.type}/{it['rating_key']}\" "
+                f"librarySectionID=\"{it['section']}\" updatedAt=\"{it['updated_at']}\">"
+                f"<Guid id=\"{guid}\"/></{self.tag}>")
+
+    def _collection_xml(self, cid: int, prefs: bool = False) -> str:
+        c = self.collections[cid]
+        inner = ""
+        if prefs:
+            inner = ("<Preferences><Setting id=\"collectionSort\" type=\"int\" default=\"0\" "
+                     f"value=\"{c['sort']}\" enumValues=\"0:Release date|1:Alphabetical|2:Custom\"/>"
+                     "</Preferences>")
+        return (f"<Directory ratingKey=\"{cid}\" key=\"/library/collections/{cid}/children\" type=\"collection\" "
+                f"title={quoteattr(c['title'])} subtype=\"{self.type}\" librarySectionID=\"{c['section']}\" "
+                f"smart=\"0\" collectionSort=\"{c['sort']}\" childCount=\"{len(c['items'])}\">{inner}</Directory>")
+
+    def _uri_keys(self, uri: str) -> List[int]:
+        return [int(k) for k in uri.rsplit("/", 1)[-1].split(",") if k]
+
+    def route(self, method, path, query, body):
+        if path.startswith("/plextv"):
+            return self._plextv(path[len("/plextv"):])
+        if path == "/":
+            return _xml(machineIdentifier="bench-server", friendlyName="bench", version="1.40.0.0",
+                        myPlexUsername=self.username)
+        if path == "/library":
+            return _xml('<Directory key="sections" title="Library Sections"/>', title1="Plex Library")
+        if path == "/library/sections":
+            return _xml("".join(
+                f"<Directory key=\"{key}\" type=\"{self.type}\" title=\"{self.title} {n + 1}\" "
+                f"agent=\"tv.plex.agents.{self.type}\" updatedAt=\"{self.changed_at[key]}\" "
+                f"contentChangedAt=\"{self.changed_at[key]}\"/>" for n, key in enumerate(self.keys)),
+                size=len(self.keys))
+
+        m = re.fullmatch(r"/library/sections/(\d+)/all", path)
+        if m:
+            return self._section_all(m.group(1), query)
+
+        m = re.fullmatch(r"/library/metadata/([\d,]+)", path)
+        if m:
+            keys = [int(k) for k in m.group(1).split(",")]
+            return _xml("".join(self._item_xml(self.items[k]) for k in keys if k in self.items))
+
+        if path == "/library/collections" and method == "POST":
+            cid = self._next_collection = self._next_collection + 1
+            self.collections[cid] = {"title": query.get("title", ""), "sort": 0,
+                                     "section": query.get("sectionId", self.keys[0]),
+                                     "items": self._uri_keys(query.get("uri", ""))}
+            return _xml(self._collection_xml(cid))
+
+        m = re.fullmatch(r"/library/collections/(\d+)(/.*)?", path)
+        if m and int(m.group(1)) in self.collections:
+            return self._collection(method, int(m.group(1)), m.group(2) or "", query)
+
+        # hub visibility and anything else the push path writes
+        return _xml()
+
+    def _section_all(self, key, query):
+        items = self._in(key)
+        if query.get("X-Plex-Container-Size") == "0":
+            return _xml(size=0, totalSize=len(items))
+        if query.get("type") == "18":
+            title = query.get("title", "").lower()
+            hits = [cid for cid, c in self.collections.items()
+                    if c["section"] == key and title in c["title"].lower()]
+            return _xml("".join(self._collection_xml(cid) for cid in hits), size=len(hits))
+        since = query.get("updatedAt>>")
+        if since is not None:
+            items = [it for it in items if it["updated_at"] > int(since)]
+            return _xml("".join(self._item_xml(it) for it in items), size=len(items))
+        if key not in self._listing:
+            self._listing[key] = _xml("".join(self._item_xml(it) for it in items),
+                                      size=len(items), totalSize=len(items))[2]
+        return 200, "application/xml", self._listing[key]
+
+    def _collection(self, method, cid, rest, query):
+        c = self.collections[cid]
+        if rest == "" and method == "GET":
+            return _xml(self._collection_xml(cid, prefs="includePreferences" in query))
+        if rest == "/prefs":
+            c["sort"] = int(query.get("collectionSort", c["sort"]))
+            return _xml()
+        if rest == "/children":
+            return _xml("".join(self._item_xml(self.items[k]) for k in c["items"] if k in self.items))
+        if rest == "/items" and method == "PUT":
+            c["items"] += [k for k in self._uri_keys(query.get("uri", "")) if k not in c["items"]]
+            return _xml()
+        m = re.fullmatch(r"/items/(\d+)(/move)?", rest)
+        if m:
+            key = int(m.group(1))
+            if key in c["items"]:
+                c["items"].remove(key)
+            if m.group(2):
+                after = int(query["after"]) if "after" in query else None
+                c["items"].insert(c["items"].index(after) + 1 if after in c["items"] else 0, key)
+            return _xml()
+        return _xml()
+
+    def _plextv(self, path):
+        if path.startswith("/api/v2/user"):
+            data = (f"<user id=\"1\" uuid=\"bench\" username=\"{self.username}\" title=\"{self.username}\" "
+                    f"email=\"{self.username}@example.com\" authToken=\"bench\" scrobbleTypes=\"1\">"
+                    "<subscription active=\"0\" status=\"Inactive\"/><profile autoSelectAudio=\"1\"/></user>")
+            return 200, "application/xml", data.encode()
+        if path.startswith("/api/users"):
+            return _xml()
+        return _xml()
+
+
+class _PlexTVAdapter(HTTPAdapter):
+    def __init__(self, base: str):
+        super().__init__()
+        self.base = base
+
+    def send(self, request, **kwargs):
+        parts = urlparse(request.url)
+        request.url = f"{self.base}/plextv{parts.path}" + (f"?{parts.query}" if parts.query else "")
+        return super().send(request, **kwargs)
+
+
+def plextv_adapter(plex: FakePlex) -> HTTPAdapter:
+    """Return an adapter to mount on a session for ``https://plex.tv`` that
+    sends plex.tv account calls to *plex*'s ``/plextv`` endpoints instead."""
+    return _PlexTVAdapter(plex.url)
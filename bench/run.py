@@ -0,0 +1,252 @@
+# bench/run.py
+# Offline end-to-end benchmark: synthetic libraries of configurable size,
+# local stand-ins for TMDB / Plex / plex.tv / Tautulli (bench/fakes.py) and
+# timings for each stage of the pipeline, emitted as JSON so runs can be
+# diffed across changes.
+#
+#   python bench/run.py --sizes 1000,10000 --out bench_output.json
+#   python bench/run.py --sizes 200000 --tmdb-latency 0.05 --enrich-sample 500
+#
+# Stages, per library size:
+#   library_refresh      first full listing of every section (library_watch.refresh)
+#   enrich               TMDB enrichment of --enrich-sample titles over HTTP
+#   enrich_cached        enrichment of the whole library from the metadata store
+#   build_features       FeatureSpace fit + transform
+#   train_index          vector index build (--backend)
+#   neighbor_table       precomputed top-K neighbour table (neighbor_table.py)
+#   full_build           rec_engine._build(force=True), cache written to disk
+#   cache_load           cold load of the cached model (signature check + mmap)
+#   recommend_from_seeds warm queries with --seeds random seeds each
+#   tautulli_history     first (full) and second (delta) history sync
+#   profile_*            taste-profile recs: built from history, then one new watch folded in
+#   batch_users          recommend_for_users over --users synthetic users in one pass
+#   push_recs_*          first push, identical repeat, push with new seeds
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+sys.path.insert(0, str(ROOT))
+
+import pandas as pd                                            # noqa: E402
+
+import fakes                                                   # noqa: E402
+import synth                                                   # noqa: E402
+
+USER = "bench"
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Recorder:
+    """Times stages and snapshots per-server request counts for each."""
+
+    def __init__(self, servers: dict):
+        self.servers = servers
+        self.stages = {}
+
+    def run(self, name: str, fn, *args, repeat: int = 1, **kwargs):
+        for srv in self.servers.values():
+            srv.reset_counts()
+        times, result = [], None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            times.append(time.perf_counter() - t0)
+        entry = {"seconds": statistics.median(times)}
+        if repeat > 1:
+            entry["min_seconds"] = min(times)
+            entry["max_seconds"] = max(times)
+            entry["repeat"] = repeat
+        requests = {srv_name: dict(srv.counts) for srv_name, srv in self.servers.items() if srv.counts}
+        if requests:
+            entry["requests"] = requests
+        throttled = {srv_name: srv.throttled for srv_name, srv in self.servers.items() if srv.throttled}
+        if throttled:
+            entry["throttled"] = throttled
+        self.stages[name] = entry
+        return result
+
+
+def _connect(args, tmdb, plex, tautulli_srv):
+    """Point the project's shared clients at the stand-in servers.
+
+    Clients are replaced directly rather than through environment variables,
+    so a developer's own .env (loaded with override=True) can't leak in.
+    """
+    import plex_context
+    import plex_playlist
+    import tautulli
+    import tmdb_client
+
+    tmdb_client._client = tmdb_client.TMDBClient("bench", base_url=tmdb.url,
+                                                 rate=args.tmdb_client_rate, workers=args.tmdb_workers)
+    ctx = plex_context.PlexContext(plex.url, "bench")
+    ctx.tv_session.mount("https://plex.tv", fakes.plextv_adapter(plex))
+    plex_context._context = ctx
+    tautulli.TAUTULLI_BASE_URL = tautulli_srv.url
+    tautulli.TAUTULLI_TOKEN = "bench"
+    plex_playlist.USE_WATCHLIST = False
+
+
+def run_size(n: int, args) -> dict:
+    print(f"[bench] size={n}: generating library …", file=sys.stderr)
+    t0 = time.perf_counter()
+    items, details = synth.library(n, args.kind, seed=args.seed)
+    plays = synth.history(items, args.plays, seed=args.seed)
+    gen_s = time.perf_counter() - t0
+
+    servers = {
+        "tmdb": fakes.FakeTMDB(details, latency=args.tmdb_latency, rate=args.tmdb_rate).start(),
+        "plex": fakes.FakePlex(items, args.kind, USER, sections=args.sections,
+                                latency=args.plex_latency).start(),
+        "tautulli": fakes.FakeTautulli(USER, plays, latency=args.tautulli_latency).start(),
+    }
+    workdir = Path(tempfile.mkdtemp(prefix="plexrec-bench-"))
+    cwd = os.getcwd()
+    os.chdir(workdir)          # every cache path in the project is relative
+    try:
+        _connect(args, servers["tmdb"], servers["plex"], servers["tautulli"])
+        import metrics
+        before = metrics.snapshot()
+        # the project prints progress; keep stdout clean for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            stages = _stages(n, args, servers, details)
+        recorded = metrics.summary(before)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        for srv in servers.values():
+            srv.stop()
+    return {"size": n, "kind": args.kind, "generate_seconds": gen_s, "stages": stages,
+            "metrics": recorded}
+
+
+def _stages(n: int, args, servers: dict, details: dict) -> dict:
+    import library_watch
+    import rec_engine
+    from gen_recs import Model, Movie, TVShow
+    from neighbor_table import NeighborTable
+    from plex_playlist import push_recs
+    from tautulli import get_recently_watched
+    from tmdb_store import MetaStore, meta_key
+
+    rec = Recorder(servers)
+    kind = args.kind
+    lib_df = rec.run("library_refresh", lambda: pd.concat(
+        [library_watch.refresh(kind, s)[0] for s in library_watch.sections(kind)], ignore_index=True))
+
+    # live enrichment on a sample; the rest is written straight to the store
+    sample = lib_df.head(args.enrich_sample)
+    rec.run("enrich", rec_engine._enrich, kind, sample)
+    rec.stages["enrich"]["titles"] = len(sample)
+    parser = Movie() if kind == "movie" else TVShow()
+    rest = lib_df.iloc[len(sample):]
+    store = MetaStore(rec_engine._META_DB)
+    try:
+        store.put_many(kind, {meta_key(row): parser.parse(details[int(row["tmdb_id"])])
+                              for _, row in rest.iterrows()})
+    finally:
+        store.close()
+
+    meta = rec.run("enrich_cached", rec_engine._enrich, kind, lib_df)
+    df = pd.concat([lib_df.reset_index(drop=True), meta.reset_index(drop=True)], axis=1)
+    _, X = rec.run("build_features", Model().fit_features, df)
+    rec.run("train_index", Model().train_index, X, backend=args.backend)
+    rec.run("neighbor_table", NeighborTable.build, X)
+    rec.run("full_build", rec_engine._build, kind, force=True)
+
+    def cold_load():
+        rec_engine._LOADED.clear()
+        return rec_engine._build(kind)
+    rec.run("cache_load", cold_load, repeat=args.repeat)
+
+    titles = lib_df["title"].tolist()
+    rng = random.Random(args.seed)
+    queries = [rng.sample(titles, min(args.seeds, len(titles))) for _ in range(args.queries)]
+    it = iter(queries)
+    rec.run("recommend_from_seeds", lambda: rec_engine.recommend_from_seeds(next(it), kind),
+            repeat=len(queries))
+
+    media_type = "movie" if kind == "movie" else "episode"
+    history = rec.run("tautulli_history_full", get_recently_watched, username=USER, media_type=media_type)
+    rec.run("tautulli_history_delta", get_recently_watched, username=USER, media_type=media_type)
+
+    rec.run("profile_first", rec_engine.recommend_for_user, USER, history, kind)
+    newest = history["watched_at"].max() + pd.Timedelta(minutes=5)
+    one = pd.DataFrame({"title": [rng.choice(titles)], "watched_at": [newest]})
+    rec.run("profile_update", rec_engine.recommend_for_user, USER, one, kind)
+
+    users = {f"user{i}": pd.DataFrame({"title": rng.sample(titles, min(10, len(titles))),
+                                       "watched_at": pd.date_range("2026-01-01", periods=min(10, len(titles)), freq="h")})
+             for i in range(args.users)}
+    rec.run("batch_users", rec_engine.recommend_for_users, users, kind)
+    rec.stages["batch_users"]["users"] = args.users
+
+    seeds = history["title"].tolist()
+    rec.run("push_recs_first", push_recs, USER, seeds, kind)
+    rec.run("push_recs_repeat", push_recs, USER, seeds, kind)
+    rec.run("push_recs_changed", push_recs, USER, queries[0], kind)
+    return rec.stages
+
+
+def main():
+    p = argparse.ArgumentParser(description="Offline pipeline benchmark")
+    p.add_argument("--sizes", default="1000,10000", help="comma separated library sizes (1k–200k)")
+    p.add_argument("--kind", default="movie", choices=("movie", "tv"))
+    p.add_argument("--sections", type=int, default=1, help="library sections the titles are spread over")
+    p.add_argument("--backend", default="brute", choices=("brute", "ivf"), help="index backend")
+    p.add_argument("--enrich-sample", type=int, default=1000, help="titles enriched over HTTP per size")
+    p.add_argument("--tmdb-latency", type=float, default=0.02, help="seconds added to each TMDB response")
+    p.add_argument("--tmdb-rate", type=float, default=50, help="TMDB server limit, requests/s (0 = none)")
+    p.add_argument("--tmdb-client-rate", type=float, default=40, help="client-side TMDB rate limit")
+    p.add_argument("--tmdb-workers", type=int, default=8)
+    p.add_argument("--plex-latency", type=float, default=0.005)
+    p.add_argument("--tautulli-latency", type=float, default=0.01)
+    p.add_argument("--plays", type=int, default=500, help="synthetic history rows")
+    p.add_argument("--queries", type=int, default=20, help="recommend_from_seeds calls timed")
+    p.add_argument("--seeds", type=int, default=10, help="seed titles per query")
+    p.add_argument("--users", type=int, default=200, help="users scored in the batch_users stage")
+    p.add_argument("--repeat", type=int, default=3, help="repeats for cache_load")
+    p.add_argument("--seed", type=int, default=0, help="RNG seed for the synthetic data")
+    p.add_argument("--out", help="write JSON here instead of stdout")
+    args = p.parse_args()
+    args.tmdb_rate = args.tmdb_rate or None
+
+    report = {
+        "version": 1,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": vars(args),
+        "runs": [run_size(int(n), args) for n in args.sizes.split(",") if n.strip()],
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text)
+        print(f"[bench] wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench/startup.py
+# Cold-start cost of the webhook / service entry points.
+#
+# Every measurement runs in a fresh interpreter, so nothing is shared with
+# this process or between runs:
+#   • import time of each entry module and which heavy packages it pulled in
+#   • handling an ignored Tautulli event end to end
+#   • (with --seeds) import + first recommendation from the on-disk cache
+#
+#   python bench/startup.py                      # imports + ignored event
+#   python bench/startup.py --seeds "Inception"  # + first recommendation
+#   python bench/startup.py --json               # machine-readable
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY = ("pandas", "sklearn", "scipy", "plexapi", "pyarrow")
+MODULES = ("webhook_client", "tautulli_webhook", "plex_context", "rec_engine", "plex_playlist", "rec_service")
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+{setup}
+t1 = time.perf_counter()
+{action}
+t2 = time.perf_counter()
+print(json.dumps({{"import_s": t1 - t0, "action_s": t2 - t1,
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _probe(setup: str, action: str = "pass") -> dict:
+    code = _PROBE.format(setup=setup, action=action, heavy=HEAVY)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True,
+                         text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _median(setup: str, action: str, repeat: int) -> dict:
+    runs = [_probe(setup, action) for _ in range(repeat)]
+    return {
+        "import_s": statistics.median(r["import_s"] for r in runs),
+        "action_s": statistics.median(r["action_s"] for r in runs),
+        "loaded": runs[-1]["loaded"],
+    }
+
+
+def measure(repeat: int = 3, seeds=None, kind: str = "movie") -> dict:
+    results = {}
+    for mod in MODULES:
+        results[f"import {mod}"] = _median(f"import {mod}", "pass", repeat)
+    results["ignored event"] = _median(
+        "import tautulli_webhook",
+        "tautulli_webhook.process({'event': 'pause', 'media_type': 'movie', 'username': 'bench'})",
+        repeat,
+    )
+    if seeds:
+        results[f"first {kind} recommendation"] = _median(
+            "import rec_engine",
+            f"rec_engine.recommend_from_seeds({list(seeds)!r}, {kind!r})",
+            repeat,
+        )
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Measure import and first-query latency")
+    p.add_argument("--repeat", type=int, default=3, help="fresh interpreters per measurement (median)")
+    p.add_argument("--seeds", nargs="*", help="titles for a first-recommendation run (needs a built cache)")
+    p.add_argument("--kind", default="movie", choices=("movie", "tv"))
+    p.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = p.parse_args()
+
+    results = measure(args.repeat, args.seeds, args.kind)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'measurement':<32} {'import':>8} {'action':>8}  heavy modules loaded")
+    for name, r in results.items():
+        print(f"{name:<32} {r['import_s']:>7.3f}s {r['action_s']:>7.3f}s  {', '.join(r['loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench/synth.py
+# Synthetic Plex libraries with TMDB-shaped metadata, for benchmarks.
+#
+# Distributions are chosen to look like a real library rather than noise:
+# genres follow TMDB's rough frequencies (drama and comedy dominate), cast
+# and directors are drawn from Zipf-weighted pools (a few prolific names,
+# a long tail), and overviews mix genre "topic" words with a shared Zipf
+# vocabulary so TF-IDF + SVD find real structure.
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+GENRES = {   # name → relative frequency
+    "Drama": 30, "Comedy": 20, "Thriller": 12, "Action": 11, "Romance": 9,
+    "Horror": 8, "Crime": 7, "Documentary": 7, "Adventure": 6, "Science Fiction": 5,
+    "Family": 4, "Mystery": 4, "Fantasy": 4, "Animation": 4, "History": 2,
+    "Music": 2, "War": 2, "Western": 1,
+}
+_GENRE_IDS = {name: 1000 + i for i, name in enumerate(GENRES)}
+
+
+def _zipf_weights(n: int, s: float) -> np.ndarray:
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+
+def _names(prefix: str, n: int, sep: str = " ") -> np.ndarray:
+    return np.array([f"{prefix}{sep}{i}" for i in range(n)], dtype=object)
+
+
+def library(n: int, kind: str = "movie", seed: int = 0) -> Tuple[List[dict], Dict[int, dict]]:
+    """Return `(items, details)` for a library of *n* titles.
+
+    *items* are Plex-side rows (`rating_key`, `title`, `tmdb_id`, `updated_at`);
+    *details* maps each TMDB id to the body TMDB would return for
+    `/movie/{id}?append_to_response=credits` (or the `/tv/{id}` equivalent
+    with `credits,season/1`).
+    """
+    rng = np.random.default_rng(seed)
+    genre_names = np.array(list(GENRES), dtype=object)
+    genre_p = np.array(list(GENRES.values()), float)
+    genre_p /= genre_p.sum()
+
+    actors = _names("Actor", max(50, n * 3))
+    actor_p = _zipf_weights(len(actors), 1.05)
+    directors = _names("Director", max(10, n // 4))
+    director_p = _zipf_weights(len(directors), 0.9)
+
+    vocab = _names("w", 5000, sep="")
+    vocab_p = _zipf_weights(len(vocab), 1.1)
+    topics = {g: _names(g.lower().replace(" ", ""), 200, sep="") for g in GENRES}
+
+    n_genres = rng.choice([1, 2, 3], size=n, p=[0.35, 0.45, 0.2])
+    cast_draws = rng.choice(len(actors), size=(n, 8), p=actor_p)
+    director_draws = rng.choice(len(directors), size=n, p=director_p)
+    overview_len = rng.integers(25, 80, size=n)
+    words_all = vocab[rng.choice(len(vocab), size=int(overview_len.sum()), p=vocab_p)]
+    word_off = np.concatenate([[0], np.cumsum(overview_len)])
+    runtimes = np.clip(rng.normal(105 if kind == "movie" else 45, 20, size=n), 10, 240).astype(int)
+    votes = np.clip(rng.normal(6.4, 1.1, size=n), 0, 10).round(1)
+    years = rng.integers(1950, 2026, size=n)
+
+    items, details = [], {}
+    for i in range(n):
+        tmdb_id = 100_000 + i
+        genres = list(rng.choice(genre_names, size=n_genres[i], replace=False, p=genre_p))
+        words = words_all[word_off[i]:word_off[i + 1]]
+        topic = rng.choice(topics[genres[0]], size=overview_len[i] // 2)
+        overview = " ".join(rng.permutation(np.concatenate([words, topic])))
+        cast = [{"name": actors[a]} for a in dict.fromkeys(cast_draws[i].tolist())]
+        director = {"name": directors[director_draws[i]], "job": "Director", "department": "Directing"}
+        title = f"Synthetic {'Movie' if kind == 'movie' else 'Show'} {i}"
+        date = f"{years[i]}-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}"
+
+        body = {
+            "id": tmdb_id,
+            "overview": overview,
+            "genres": [{"id": _GENRE_IDS[g], "name": g} for g in genres],
+            "vote_average": float(votes[i]),
+            "credits": {"cast": cast, "crew": [director]},
+        }
+        if kind == "movie":
+            body.update(title=title, runtime=int(runtimes[i]), release_date=date)
+        else:
+            body.update(name=title, episode_run_time=[int(runtimes[i])], first_air_date=date,
+                        **{"season/1": {"episodes": [{"guest_stars": [], "crew": [director]}]}})
+        details[tmdb_id] = body
+        items.append({"rating_key": 10_000 + i, "title": title, "tmdb_id": tmdb_id,
+                      "updated_at": 1_700_000_000 + i})
+    return items, details
+
+
+def history(items: List[dict], plays: int, seed: int = 0) -> List[dict]:
+    """Return *plays* Tautulli history rows over *items*, newest first."""
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.choice(len(items), size=plays, p=_zipf_weights(len(items), 0.8))
+    now = 1_760_000_000
+    return [
+        {"id": plays - j, "date": now - j * 3600, "title": items[k]["title"],
+         "grandparent_title": items[k]["title"]}
+        for j, k in enumerate(picks.tolist())
+    ]
@@ -0,0 +1,60 @@
+# file_lock.py
+# Advisory exclusive lock on a file, shared by every process (and thread)
+# that opens the same path – the single-flight guard around cache builds,
+# since each Tautulli event may run in a process of its own.
+#
+#   with file_lock(path, timeout=60) as held:
+#       if held:
+#           ...                      # nobody else is inside this block
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+
+    def _try_lock(fh):
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(fh):
+        fcntl.flock(fh, fcntl.LOCK_UN)
+except ImportError:          # Windows
+    import msvcrt
+
+    def _try_lock(fh):
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock(fh):
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+_POLL = 0.2   # seconds between attempts
+
+
+@contextmanager
+def file_lock(path: Path, timeout: Optional[float] = None):
+    """Hold an exclusive lock on *path* for the block.
+
+    Yields True once held, or False if it couldn't be had within *timeout*
+    seconds (``None`` waits as long as it takes). The lock goes away with
+    the process, so a crashed holder never leaves it stuck.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with open(path, "a+") as fh:
+        while True:
+            try:
+                _try_lock(fh)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    yield False
+                    return
+                time.sleep(_POLL)
+        try:
+            yield True
+        finally:
+            _unlock(fh)
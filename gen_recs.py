@@ -1,127 +1,208 @@
 import os
-import requests
 import numpy as np
 import pandas as pd
-from plexapi.server import PlexServer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
-from sklearn.preprocessing import MultiLabelBinarizer, MinMaxScaler
-from sklearn.neighbors import NearestNeighbors
+import scipy.sparse as sp
 from dotenv import load_dotenv
-import os
+from tmdb_store import meta_key
+from tmdb_client import NotFound, get_client
+from vector_index import INDEX_BACKEND, make_index
+from plex_context import context
 
 load_dotenv(override=True)
 
-PLEX_BASE_URL = os.getenv("PLEX_BASE_URL")
-PLEX_TOKEN = os.getenv("PLEX_TOKEN")
-TMDB_API_KEY = os.getenv("TMDB_TOKEN")
-
-plex = PlexServer(PLEX_BASE_URL, PLEX_TOKEN)
-
 class Movie():
     def tmdb_get(self, path, **params):
-        url = f"https://api.themoviedb.org/3{path}"
-        params["api_key"] = TMDB_API_KEY
-        return requests.get(url, params=params).json()
+        return get_client().get(path, **params)
     
+    def fetch_one(self, key):
+        """Return the TMDB detail body for one store key (``tmdb:<id>``), or
+        ``None`` when TMDB has no such title."""
+        tid = key.split(":", 1)[1]
+        # credits ride along on the details call – one request per title
+        try:
+            return self.tmdb_get(f"/movie/{tid}", language="en-US", append_to_response="credits")
+        except NotFound:
+            return None
+
+    def enrich_one(self, key):
+        """Return the metadata row for one store key, or ``None`` (see `fetch_one`)."""
+        body = self.fetch_one(key)
+        return None if body is None else self.parse(body)
+
+    def parse(self, info):
+        """Turn a `/movie/{id}?append_to_response=credits` body into a metadata row."""
+        creds = info.get("credits") or {}
+
+        genres   = [g["name"] for g in info.get("genres", [])]
+        overview = info.get("overview", "") or ""
+        runtime  = info.get("runtime") or 0
+        vote     = info.get("vote_average") or 0
+        rd       = info.get("release_date") or ""
+
+        cast5 = [c["name"] for c in creds.get("cast", [])[:5] if c.get("name")]
+        dirs  = [c["name"] for c in creds.get("crew", []) if c.get("job") == "Director"]
+
+        return {
+            "overview": overview,
+            "genres": genres,
+            "runtime": runtime,
+            "vote": vote,
+            "release_date": rd,
+            "cast": cast5,
+            "directors": dirs
+        }
+
     def enrich_with_tmdb(self, df):
-        meta = []
-        for _, row in df.iterrows():
-            tid = row["tmdb_id"]
-            info  = self.tmdb_get(f"/movie/{tid}", language="en-US")
-            creds = self.tmdb_get(f"/movie/{tid}/credits")
-
-            genres   = [g["name"] for g in info.get("genres", [])]
-            overview = info.get("overview", "") or ""
-            runtime  = info.get("runtime") or 0
-            vote     = info.get("vote_average") or 0
-            rd       = info.get("release_date") or ""
-
-            cast5 = [c["name"] for c in creds.get("cast", [])[:5] if c.get("name")]
-            dirs  = [c["name"] for c in creds.get("crew", []) if c.get("job") == "Director"]
-
-            meta.append({
-                "overview": overview,
-                "genres": genres,
-                "runtime": runtime,
-                "vote": vote,
-                "release_date": rd,
-                "cast": cast5,
-                "directors": dirs
-            })
-        return pd.DataFrame(meta)
+        keys = [meta_key(row) for _, row in df.iterrows()]
+        rows = dict(get_client().map(self.enrich_one, dict.fromkeys(keys)))
+        return pd.DataFrame([rows[k] or self.parse({}) for k in keys])
     
 class TVShow:
     def tmdb_get(self, path, **params):
-        url = f"https://api.themoviedb.org/3{path}"
-        params["api_key"] = TMDB_API_KEY
-        return requests.get(url, params=params).json()
+        return get_client().get(path, **params)
+
+    def _tmdb_id(self, key):
+        """Resolve a store key to a TMDB id (``tvdb:`` keys go through /find)."""
+        source, ext_id = key.split(":", 1)
+        if source == "tmdb":
+            return ext_id
+        found = self.tmdb_get(f"/find/{ext_id}", external_source="tvdb_id")
+        hits = found.get("tv_results") or []
+        return hits[0]["id"] if hits else None
+
+    def fetch_one(self, key):
+        """Return the TMDB detail body for one store key (``tmdb:`` or ``tvdb:``),
+        or ``None`` when TMDB has no such show."""
+        tid = self._tmdb_id(key)
+        if tid is None:
+            return None
+        # show credits + season 1 ride along on the details call
+        try:
+            return self.tmdb_get(f"/tv/{tid}", append_to_response="credits,season/1")
+        except NotFound:
+            return None
+
+    def enrich_one(self, key):
+        """Return the metadata row for one store key, or ``None`` (see `fetch_one`)."""
+        body = self.fetch_one(key)
+        return None if body is None else self.parse(body)
+
+    def parse(self, data):
+        """Turn a `/tv/{id}?append_to_response=credits,season/1` body into a metadata row."""
+        episodes = (data.get("season/1") or {}).get("episodes") or [{}]
+        # Fetch top 5 actors: the show-level credits (the current season's regulars),
+        # else episode 1's guest stars; directors come from episode 1's crew
+        cast_resp = {
+            "cast": (data.get("credits") or {}).get("cast"),
+            "guest_stars": episodes[0].get("guest_stars"),
+            "crew": episodes[0].get("crew"),
+        }
+
+        genres = [g["name"] for g in data.get("genres", [])]
+        overview = data.get("overview", "") or ""
+        runtime_list = data.get("episode_run_time") or []
+        if (len(runtime_list) == 0):
+            runtime = 0
+        else:
+            runtime = runtime_list[0]
+        first_air = data.get("first_air_date", "") or ""
+
+        cast = cast_resp.get("cast") or []
+        if (len(cast) == 0):
+            cast = cast_resp.get("guest_stars") or []
+        crew = cast_resp.get("crew") or []
+        cast5 = [a.get("name") for a in cast][:5]
+        dirs = []
+        for c in crew:
+            if (c.get("department") == "Directing"):
+                dirs.append(c.get("name"))
+
+        return {
+            "overview": overview,
+            "genres": genres,
+            "runtime": runtime, 
+            "vote": data.get("vote_average", 0),
+            "release_date": first_air,
+            "cast": cast5,
+            "directors": dirs
+        }
 
     def enrich_with_tmdb(self, df):
-        meta = []
-        for _, row in df.iterrows():
-            tid = row["tmdb_id"]
-            data = self.tmdb_get(f"/tv/{tid}")
-
-            genres = [g["name"] for g in data.get("genres", [])]
-            overview = data.get("overview", "") or ""
-            runtime_list = data.get("episode_run_time")
-            if (len(runtime_list) == 0):
-                runtime = 0
-            else:
-                runtime = runtime_list[0]
-            first_air = data.get("first_air_date", "")
-
-            # Fetch top 5 actors
-            cast_resp = self.tmdb_get(f"/tv/{tid}/season/1/episode/1/credits")
-            cast = cast_resp.get("cast")
-            if (len(cast) == 0):
-                cast = cast_resp.get("guest_stars")
-            crew = cast_resp.get("crew")
-            cast5 = [a.get("name") for a in cast][:5]
-            dirs = []
-            for c in crew:
-                if (c.get("department") == "Directing"):
-                    dirs.append(c.get("name"))
-
-            meta.append({
-                "overview": overview,
-                "genres": genres,
-                "runtime": runtime, 
-                "vote": data.get("vote_average", 0),
-                "release_date": first_air,
-                "cast": cast5,
-                "directors": dirs
-            })
-        return pd.DataFrame(meta)
+        keys = [meta_key(row) for _, row in df.iterrows()]
+        rows = dict(get_client().map(self.enrich_one, dict.fromkeys(keys)))
+        return pd.DataFrame([rows[k] or self.parse({}) for k in keys])
+
+
+def section_type(media_type="Movies"):
+    """Return the Plex section type ('movie' | 'show') that holds *media_type*."""
+    return "movie" if media_type.lower().startswith("m") else "show"
+
+
+def pick_guid(guid_ids):
+    """Return `(column, id)` – e.g. ``("tmdb_id", "603")`` – from Plex guid
+    strings, or ``(None, None)`` when neither a tmdb nor a tvdb id is present."""
+    for gid in guid_ids:
+        key = "this can't be in anything"
+        if ("tmdb" in gid):
+            key = "tmdb"
+        elif ("tvdb" in gid):
+            key = "tvdb"
+        if key in gid:
+            return f"{key}_id", gid.split("//")[-1].split("?")[0]
+    return None, None
 
 
 def fetch_plex_list(media_type="Movies"):
-    section = "Movies" if media_type.lower().startswith("m") else "TV Shows"
+    """List every movie (or show) section of the server – not just the first."""
+    wanted = section_type(media_type)
     rows = []
-    for m in plex.library.section(section).all():
-        tmdb_id = None
-        for g in m.guids:
-            key = "this can't be in anything"
-            if ("tmdb" in g.id):
-                key = "tmdb"
-            elif ("tvdb" in g.id):
-                key = "tvdb"
-            if key in g.id:
-                tmdb_id = g.id.split("//")[-1].split("?")[0]
-                break
-        if tmdb_id:
-            rows.append({"title": m.title, f"{key}_id": tmdb_id})
+    for section in context().server().library.sections():
+        if section.type != wanted:
+            continue
+        for m in section.all():
+            col, tmdb_id = pick_guid([g.id for g in m.guids])
+            if tmdb_id:
+                rows.append({"title": m.title, col: tmdb_id,
+                             "rating_key": int(m.ratingKey), "section_id": int(m.librarySectionID)})
     return pd.DataFrame(rows)
 
 
 
-class Model():
-    def build_features(self, df):
-        G = MultiLabelBinarizer().fit_transform(df["genres"].tolist())
-        C = MultiLabelBinarizer().fit_transform(df["cast"].tolist())
-        D = MultiLabelBinarizer().fit_transform(df["directors"].tolist())
+class FeatureSpace():
+    """Feature transforms fitted once and then frozen.
+
+    `fit` learns the genre/cast/director vocabularies, the numeric scaler
+    ranges and the TF-IDF + SVD projection; `transform` maps any rows into
+    that fixed space, so new titles can be appended without a refit.
+    Labels never seen at fit time are dropped (see `unseen_ratio`).
 
+    scikit-learn is imported here rather than at module level: only builds
+    and appends need it, the query path runs on NumPy and the saved index.
+    """
+
+    LABELS = ("genres", "cast", "directors")
+
+    def fit(self, df):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.preprocessing import MultiLabelBinarizer, MinMaxScaler
+
+        self.binarizers = {
+            col: MultiLabelBinarizer(sparse_output=True).fit(df[col].tolist())
+            for col in self.LABELS
+        }
+        self.scaler = MinMaxScaler().fit(self._numeric(df))
+
+        overviews = df["overview"].fillna("").tolist()
+        self.tfidf = TfidfVectorizer(max_features=2000, stop_words="english").fit(overviews)
+        self.svd = TruncatedSVD(n_components=100, random_state=42)\
+            .fit(self.tfidf.transform(overviews))
+
+        self.n_fit = len(df)
+        return self
+
+    @staticmethod
+    def _numeric(df):
         runtimes = df["runtime"].fillna(0).astype(float).values
         votes    = df["vote"].fillna(0).astype(float).values
         years    = (
@@ -129,40 +210,137 @@ class Model():
             .dt.year.fillna(2000).astype(int)
             .values
         )
-        nums = np.vstack([runtimes, votes, years]).T
+        return np.vstack([runtimes, votes, years]).T
+
+    def transform(self, df):
+        """Return a float32 CSR matrix for *df* with unit-length rows.
+
+        The multi-hot genre/cast/director blocks stay sparse, so memory and
+        disk scale with non-zeros rather than with vocabulary size; the
+        numeric and SVD columns are small dense blocks stored alongside.
+        Rows are L2-normalised, so cosine similarity is a plain dot product.
+        """
+        from sklearn.preprocessing import normalize
 
-        N = MinMaxScaler().fit_transform(nums)
+        blocks = []
+        for col in self.LABELS:
+            mlb = self.binarizers[col]
+            known = set(mlb.classes_)
+            blocks.append(mlb.transform([[l for l in labels if l in known]
+                                         for labels in df[col].tolist()]))
+
+        # frozen ranges – clip so out-of-range newcomers stay in [0, 1]
+        blocks.append(np.clip(self.scaler.transform(self._numeric(df)), 0, 1))
 
         overviews = df["overview"].fillna("").tolist()
-        Xtxt = TfidfVectorizer(max_features=2000, stop_words="english")\
-            .fit_transform(overviews)
-        Ttxt = TruncatedSVD(n_components=100, random_state=42)\
-            .fit_transform(Xtxt)
+        blocks.append(self.svd.transform(self.tfidf.transform(overviews)))
+        return normalize(sp.hstack(blocks, format="csr", dtype=np.float32))
 
-        X = np.hstack([G, C, D, N, Ttxt]).astype(float)
-        return X
+    def label_counts(self, df):
+        """Return `(total, unseen)` genre/cast/director labels of *df*."""
+        total = unseen = 0
+        for col in self.LABELS:
+            known = set(self.binarizers[col].classes_)
+            for labels in df[col].tolist():
+                total += len(labels)
+                unseen += sum(1 for l in labels if l not in known)
+        return total, unseen
 
+    def unseen_ratio(self, df):
+        """Fraction of *df*'s genre/cast/director labels missing from the vocabularies."""
+        total, unseen = self.label_counts(df)
+        return unseen / total if total else 0.0
 
-    def train_index(self, X):
-        # brute‐force cosine on a dense array
-        return NearestNeighbors(
-            n_neighbors=6,
-            metric="cosine",
-            algorithm="brute"
-        ).fit(X)
 
+class Model():
+    def fit_features(self, df):
+        """Return `(space, X)` – the frozen `FeatureSpace` and its matrix for *df*."""
+        space = FeatureSpace().fit(df)
+        return space, space.transform(df)
 
-    def recommend(self, title, df, X, knn):
+    def build_features(self, df):
+        return self.fit_features(df)[1]
+
+
+    def train_index(self, X, backend=INDEX_BACKEND):
+        # cosine index over the unit-norm rows – 'brute' (exact) or 'ivf'
+        return make_index(backend).fit(X)
+
+
+    def recommend(self, title, df, X, knn, n=5):
+        """Return the *n* nearest live titles to *title*.
+
+        Rows flagged in an optional boolean ``removed`` column are
+        tombstones: they stay in `X` / the index but are never returned.
+        """
         if "title" not in df.columns:
             raise KeyError("DataFrame must have a 'title' column")
-        mask = df["title"] == title
+        live = ~df["removed"] if "removed" in df.columns else pd.Series(True, index=df.index)
+        mask = (df["title"] == title) & live
         if not mask.any():
             raise ValueError(f"'{title}' not in library")
         idx = df.index[mask][0]
-        dist, nn = knn.kneighbors(X[idx].reshape(1, -1), n_neighbors=6)
-        recs = df.iloc[nn[0]][["title"]].copy()
-        recs["score"] = 1 - dist[0]
-        return recs.iloc[1:].reset_index(drop=True)
+        removed = None if live.all() else ~live.values
+        nn, scores = knn.search(X[idx:idx + 1], n + 1, exclude=removed)
+        keep = (nn[0] >= 0) & (nn[0] != idx)
+        recs = df.iloc[nn[0][keep]][["title"]].copy()
+        recs["score"] = scores[0][keep]
+        return recs.head(n).reset_index(drop=True)
+
+    def title_index(self, df):
+        """Return ``{title: row}`` over live rows; the first duplicate wins."""
+        live = ~df["removed"].values if "removed" in df.columns else np.ones(len(df), bool)
+        rows = np.flatnonzero(live)[::-1]      # reversed so earlier rows overwrite
+        return dict(zip(df["title"].values[rows], rows.tolist()))
+
+    def recommend_many(self, rows, df, X, knn, n=5, top_n=25, table=None):
+        """Query every seed row in one index call and merge the results.
+
+        Each seed contributes its *n* best live neighbours (itself excluded);
+        hits are deduplicated by title keeping the earliest seed's, then the
+        *top_n* best scores are returned as a `(title, score, seed)` frame,
+        plus the Plex ``rating_key`` of each hit when *df* carries one.
+        A precomputed `NeighborTable` (*table*) answers from lookups instead
+        of the index when it is wide enough for *n*; seeds whose table row
+        has fewer than *n* live neighbours left (tombstones) are searched.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        keyed = "rating_key" in df.columns
+        if rows.size == 0 or n < 1 or X.shape[0] < 2:
+            return pd.DataFrame(columns=["title", "score", "seed"] + ["rating_key"] * keyed)
+        titles = df["title"].values
+        removed = df["removed"].values if "removed" in df.columns else None
+
+        # one extra neighbour per seed, since a seed finds itself first
+        if table is not None and table.k >= n and len(table) == X.shape[0]:
+            top, scores = table.lookup(rows, n + 1, exclude=removed)
+            live = X.shape[0] if removed is None else int(len(removed) - removed.sum())
+            short = np.flatnonzero((top >= 0).sum(axis=1) < min(n, live - 1))
+            if short.size:
+                top[short], scores[short] = knn.search(X[rows[short]], n + 1, exclude=removed)
+        else:
+            top, scores = knn.search(X[rows], n + 1, exclude=removed)
+        scores[top == rows[:, None]] = -np.inf
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :n]
+        top = np.take_along_axis(top, order, axis=1).ravel()
+        scores = np.take_along_axis(scores, order, axis=1).ravel()
+        seeds = np.repeat(rows, order.shape[1])
+
+        hit = np.isfinite(scores) & (top >= 0)
+        top, scores, seeds = top[hit], scores[hit], seeds[hit]
+        _, first = np.unique(titles[top], return_index=True)
+        if first.size > top_n:
+            first = first[np.argpartition(-scores[first], top_n - 1)[:top_n]]
+        first = first[np.argsort(-scores[first], kind="stable")]
+
+        recs = pd.DataFrame({
+            "title": titles[top[first]],
+            "score": scores[first],
+            "seed": titles[seeds[first]],
+        })
+        if keyed:
+            recs["rating_key"] = df["rating_key"].values[top[first]]
+        return recs
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+# job_queue.py
+# Debouncing, coalescing job queue in front of push_recs.
+#
+# Events are keyed by (user, kind). Repeated events for a key within the
+# debounce window collapse into one job (the latest payload wins); distinct
+# keys run in parallel on a bounded pool, and a key never has two jobs
+# running at once – a new event for a busy key waits for the running one.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Set
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+log = logging.getLogger(__name__)
+
+EVENT_DEBOUNCE_SECONDS = float(os.getenv("EVENT_DEBOUNCE_SECONDS", "30"))
+EVENT_MAX_WAIT_SECONDS = float(os.getenv("EVENT_MAX_WAIT_SECONDS", "300"))
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "4"))
+
+
+class _Pending:
+    __slots__ = ("payload", "first", "due", "events")
+
+    def __init__(self, payload, now: float):
+        self.payload = payload
+        self.first = now
+        self.due = now
+        self.events = 0
+
+
+class JobQueue:
+    """Run `handler(payload)` once per burst of events for the same key.
+
+    • *window*   – quiet period after the last event before the job runs.
+    • *max_wait* – upper bound from the first event, so a binge session that
+      keeps firing still gets refreshed periodically.
+    • *workers*  – jobs for different keys running at the same time.
+    """
+
+    def __init__(self, handler: Callable, *, window: float = EVENT_DEBOUNCE_SECONDS,
+                 max_wait: float = EVENT_MAX_WAIT_SECONDS, workers: int = EVENT_WORKERS):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        self.pending: Dict[Hashable, _Pending] = {}
+        self.running: Set[Hashable] = set()
+        self.cond = threading.Condition()
+        self.stats = {"events": 0, "jobs": 0, "coalesced": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._schedule, name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, key: Hashable, payload) -> int:
+        """Queue *payload* under *key*; return how many events it now covers."""
+        now = time.monotonic()
+        with self.cond:
+            self.stats["events"] += 1
+            job = self.pending.get(key)
+            if job is None:
+                job = self.pending[key] = _Pending(payload, now)
+            else:
+                self.stats["coalesced"] += 1
+                job.payload = payload
+            job.events += 1
+            job.due = min(job.first + self.max_wait, now + self.window)
+            self.cond.notify()
+            return job.events
+
+    def depth(self) -> int:
+        with self.cond:
+            return len(self.pending) + len(self.running)
+
+    def _schedule(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                ready = [k for k, j in self.pending.items()
+                         if j.due <= now and k not in self.running]
+                for key in ready:
+                    job = self.pending.pop(key)
+                    self.running.add(key)
+                    self.stats["jobs"] += 1
+                    self.pool.submit(self._run, key, job)
+                waits = [j.due - now for k, j in self.pending.items() if k not in self.running]
+                self.cond.wait(timeout=max(0.0, min(waits)) if waits else None)
+
+    def _run(self, key: Hashable, job: _Pending):
+        failed = False
+        try:
+            log.info("Running job %s (%d event(s) coalesced)", key, job.events)
+            self.handler(job.payload)
+        except Exception as exc:
+            failed = True
+            log.exception("Job %s failed: %s", key, exc)
+        finally:
+            with self.cond:
+                self.stats["failed"] += failed
+                self.running.discard(key)
+                self.cond.notify()
@@ -0,0 +1,142 @@
+# library_watch.py
+# Cheap Plex library change detection.
+#
+# `signature` costs one small request (/library/sections) and changes
+# whenever the section's content does, so the webhook hot path can validate
+# the cache without enumerating the library. When it does change, `refresh`
+# asks Plex only for items updated since the last snapshot, and falls back
+# to a full ratingKey listing only when the item count says something was
+# removed. The result is an add / remove / modify delta against the snapshot.
+#
+# Every movie / show section is tracked on its own (`sections`), with its own
+# snapshot, so a change in one section never touches the others.
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from plexapi.utils import joinArgs
+
+from gen_recs import pick_guid, section_type
+from plex_context import context
+
+_CACHE = Path("plex_rec_cache")
+
+
+def _snapshot_path(kind: str, section: dict, root: Path) -> Path:
+    return Path(root) / f"{kind}-{section['key']}_snapshot.json"
+
+
+def sections(kind: str) -> List[dict]:
+    """Return the attributes of every *kind* section, in key order (one request)."""
+    wanted = section_type(kind)
+    found = [dict(el.attrib) for el in context().server().query("/library/sections")
+             if el.attrib.get("type") == wanted]
+    if not found:
+        raise LookupError(f"No Plex library section of type {wanted!r}")
+    return sorted(found, key=lambda s: int(s["key"]))
+
+
+def signature(section: dict) -> str:
+    """Return a string that changes whenever the section's contents change."""
+    changed = section.get("contentChangedAt") or section.get("updatedAt") or ""
+    return f"{section.get('key')}:{changed}"
+
+
+def _items(section_key: str, **filters) -> Dict[str, dict]:
+    """List a section as ``{ratingKey: {title, updatedAt, <id column>}}``.
+
+    Parses the XML directly instead of building plexapi objects, and asks
+    Plex to leave out the fields we never read. Items without a tmdb/tvdb
+    guid are kept (without an id) so counts match Plex's `totalSize`.
+    """
+    params = {"includeGuids": 1, "excludeFields": "summary,tagline", **filters}
+    items = {}
+    for el in context().server().query(f"/library/sections/{section_key}/all{joinArgs(params)}"):
+        item = {"title": el.attrib.get("title"), "updatedAt": int(el.attrib.get("updatedAt") or 0)}
+        col, ext_id = pick_guid([g.attrib.get("id", "") for g in el.iter("Guid")])
+        if ext_id:
+            item[col] = ext_id
+        items[el.attrib["ratingKey"]] = item
+    return items
+
+
+def _total_size(section_key: str) -> int:
+    params = {"X-Plex-Container-Start": 0, "X-Plex-Container-Size": 0}
+    el = context().server().query(f"/library/sections/{section_key}/all{joinArgs(params)}")
+    return int(el.attrib.get("totalSize") or el.attrib.get("size") or 0)
+
+
+class Delta:
+    """Rating keys added, removed and modified since the previous snapshot."""
+
+    def __init__(self, added: List[str], removed: List[str], modified: List[str], full: bool):
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+        self.full = full            # True when the whole section was listed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+    def __repr__(self):
+        return (f"Delta(+{len(self.added)} -{len(self.removed)} ~{len(self.modified)}"
+                f"{', full listing' if self.full else ''})")
+
+
+def refresh(kind: str, section: dict, cache: Path = _CACHE,
+            out: Optional[Path] = None) -> Tuple[pd.DataFrame, Delta, str]:
+    """Bring the snapshot of one *kind* section (from `sections`) up to date.
+
+    The snapshot is read from *cache* and the new one written to *out*
+    (default: *cache*), so a cache generation can keep its own snapshot.
+    Returns `(lib_df, delta, signature)` where *lib_df* has the same columns
+    as `fetch_plex_list` (title, tmdb_id / tvdb_id, rating_key, section_id).
+    """
+    section_key = section["key"]
+    sig = signature(section)
+
+    old = _load(_snapshot_path(kind, section, cache))
+    if old is None or old.get("section") != section_key:
+        items = _items(section_key)
+        delta = Delta(list(items), [], [], full=True)
+    else:
+        prev = old["items"]
+        # one second of overlap; unchanged items re-listed here are no-ops
+        since = max((v["updatedAt"] for v in prev.values()), default=0) - 1
+        changed = _items(section_key, **{"updatedAt>>": since}) if prev else _items(section_key)
+        items = {**prev, **changed}
+        full = False
+        if len(items) != _total_size(section_key):
+            # something was removed (or replaced) – only a listing can tell what
+            items = _items(section_key)
+            full = True
+        delta = Delta(
+            added=[k for k in items if k not in prev],
+            removed=[k for k in prev if k not in items],
+            modified=[k for k in items if k in prev and items[k] != prev[k]],
+            full=full,
+        )
+
+    _save(_snapshot_path(kind, section, out or cache),
+          {"section": section_key, "signature": sig, "items": items})
+    rows = [
+        {**{k: v for k, v in item.items() if k != "updatedAt"},
+         "rating_key": int(rating_key), "section_id": int(section_key)}
+        for rating_key, item in items.items() if len(item) > 2      # has a tmdb / tvdb id
+    ]
+    return pd.DataFrame(rows), delta, sig
+
+
+def _load(path: Path) -> Optional[dict]:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save(path: Path, snap: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(snap))
+    tmp.replace(path)
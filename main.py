@@ -1,35 +1,94 @@
 import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tautulli import get_recently_watched
 from plex_playlist import push_recs
+from rec_engine import pinned, recommend_for_users
 import os
 from dotenv import load_dotenv
-from plexapi.myplex import MyPlexAccount
+from plex_context import context
+import metrics
 
 load_dotenv(override=True)
 
-PLEX_TOKEN = os.getenv("PLEX_TOKEN")
+REC_ALL_WORKERS = int(os.getenv("REC_ALL_WORKERS", "4"))
 
 def recently_watched(username, kind):
-    return get_recently_watched(username=username, media_type=kind)["title"].tolist()
-
-def rec_all():
-    account = MyPlexAccount(token=PLEX_TOKEN)
-    for user in account.users():
-        print(user)
-        username = user.username
-        recent_movie = recently_watched(username, "movie")
-        recent_tv = recently_watched(username, "episode")
-        
-        if (recent_movie):
-            push_recs(username=username, seeds=recent_movie, kind="movie")
-        if (recent_tv):
-            push_recs(username=username, seeds=recent_tv, kind="tv")
-
-    recent_movie = recently_watched(account.username, "movie")
-    recent_tv = recently_watched(account.username, "episode")
-    if (recent_movie):
-        push_recs(username=account.username, seeds=recent_movie, kind="movie")
-    if (recent_tv):
-        push_recs(username=account.username, seeds=recent_tv, kind="tv")
+    return get_recently_watched(username=username, media_type=kind)
+
+def fetch_history(username):
+    """Return `(result, {kind: history})` for one user; never raises.
+
+    *result* is the user's timing summary, with `error` set on failure.
+    """
+    result = {"user": username, "error": None}
+    t0 = time.perf_counter()
+    try:
+        history = {"movie": recently_watched(username, "movie"), "tv": recently_watched(username, "episode")}
+    except Exception as exc:
+        result["error"] = f"{type(exc).__name__}: {exc}"
+        history = {}
+    result["history_s"] = time.perf_counter() - t0
+    return result, history
+
+def push_user(result, history, recs):
+    """Push the precomputed movie + TV *recs* for one user; never raises."""
+    username = result["user"]
+    t0 = time.perf_counter()
+    try:
+        for kind in ("movie", "tv"):
+            t1 = time.perf_counter()
+            if kind in recs:
+                push_recs(username=username, seeds=history[kind]["title"].tolist(), kind=kind,
+                          recs=recs[kind])
+            result[f"{kind}_s"] = time.perf_counter() - t1
+    except Exception as exc:
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    result["total_s"] = result["history_s"] + time.perf_counter() - t0
+    return result
+
+def rec_all(workers=REC_ALL_WORKERS):
+    ctx = context()
+    usernames = [user.username for user in ctx.users()] + [ctx.account().username]
+
+    before = metrics.snapshot()
+    start = time.perf_counter()
+    # one library check / build per kind, shared by every user below
+    with pinned("movie", "tv") as kinds:
+        built_s = time.perf_counter() - start
+
+        # 1) every user's history (Tautulli), in parallel
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            fetched = list(pool.map(fetch_history, usernames))
+
+        # 2) every user's recommendations in one batched pass per kind
+        t0 = time.perf_counter()
+        recs = {r["user"]: {} for r, _ in fetched}
+        for kind in kinds:
+            watched = {r["user"]: h[kind] for r, h in fetched if not r["error"] and not h[kind].empty}
+            for user, frame in recommend_for_users(watched, kind).items():
+                recs[user][kind] = frame
+        scored_s = time.perf_counter() - t0
+
+        # 3) pushes (Plex), in parallel
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [pool.submit(push_user, r, h, recs[r["user"]]) for r, h in fetched if not r["error"]]
+            for fut in as_completed(futures):
+                results.append(fut.result())
+        results += [r for r, _ in fetched if r["error"]]
+
+    print(f"\nIndex load/build: {built_s:.1f}s, batch scoring: {scored_s:.1f}s")
+    for r in sorted(results, key=lambda r: r["user"] or ""):
+        timings = "  ".join(f"{k[:-2]}={r[k]:.1f}s" for k in ("history_s", "movie_s", "tv_s", "total_s") if k in r)
+        status = f"FAILED ({r['error']})" if r["error"] else "ok"
+        print(f"{r['user']:<24} {status:<8} {timings}")
+    failed = sum(1 for r in results if r["error"])
+    print(f"{len(results)} users, {failed} failed, {time.perf_counter() - start:.1f}s total")
+    print(f"metrics {metrics.summary_line(before, users=len(results), failed=failed)}")
+    return results
+
 if __name__ == "__main__":
-    rec_all()
+    p = argparse.ArgumentParser(description="Refresh recommendations for every user")
+    p.add_argument("--workers", type=int, default=REC_ALL_WORKERS, help="users processed in parallel")
+    rec_all(workers=p.parse_args().workers)
@@ -0,0 +1,220 @@
+# metrics.py
+# In-process instrumentation: stage timings, HTTP calls, cache decisions
+# and Plex writes, exposed as Prometheus text (rec_service.py /metrics) or
+# as one JSON summary line per run.
+#
+#   with metrics.stage("enrich"):            # duration → plexrec_stage_seconds
+#       ...
+#   metrics.CACHE.inc(kind="movie", event="rebuild", reason="drift")
+#   metrics.instrument(session)              # every response → HTTP metrics
+#
+# Set PROFILE_DIR to capture a cProfile of every webhook event / service
+# request (`metrics.profiled`); open the .prof files with snakeviz or pstats.
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(l, "")) for l in self.labels)
+
+    def _fmt(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{l}="{v}"' for l, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + n
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.values)
+
+    def prometheus(self):
+        for key, value in sorted(self.snapshot().items()):
+            yield f"{self.name}{self._fmt(key)} {value:g}"
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, *args, buckets=_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        self.values: Dict[Tuple[str, ...], list] = {}   # key → [bucket counts…, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            row = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, edge in enumerate(self.buckets):
+                if value <= edge:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {k: (v[-2], v[-1]) for k, v in self.values.items()}
+
+    def prometheus(self):
+        with self.lock:
+            rows = {k: list(v) for k, v in self.values.items()}
+        for key, row in sorted(rows.items()):
+            for edge, n in zip(self.buckets, row):
+                le = 'le="%g"' % edge
+                yield f"{self.name}_bucket{self._fmt(key, le)} {n}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{self._fmt(key, le)} {row[-1]}"
+            yield f"{self.name}_sum{self._fmt(key)} {row[-2]:.6f}"
+            yield f"{self.name}_count{self._fmt(key)} {row[-1]}"
+
+
+_REGISTRY = []
+
+STAGE = Histogram("plexrec_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+HTTP_SECONDS = Histogram("plexrec_http_request_seconds", "Outbound HTTP latency.", ("host", "endpoint"))
+HTTP_REQUESTS = Counter("plexrec_http_requests_total", "Outbound HTTP requests.", ("host", "endpoint", "status"))
+CACHE = Counter("plexrec_cache_events_total", "Model cache decisions.", ("kind", "event", "reason"))
+ENRICHED = Counter("plexrec_items_enriched_total", "Metadata rows by where they came from.", ("kind", "source"))
+SEEDS = Counter("plexrec_seeds_total", "Seed titles resolved against the library.", ("kind", "result"))
+PLEX_WRITES = Counter("plexrec_plex_writes_total", "Write requests sent to Plex / plex.tv.", ("op",))
+PUSHES = Counter("plexrec_pushes_total", "push_recs outcomes.", ("kind", "result"))
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block into `plexrec_stage_seconds{stage=name}` (also on error)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE.observe(time.perf_counter() - t0, stage=name)
+
+
+def _endpoint(url: str) -> Tuple[str, str]:
+    parts = urlparse(url)
+    path = re.sub(r"/\d[\d,]*", "/{id}", parts.path) or "/"
+    cmd = parse_qs(parts.query).get("cmd")          # Tautulli multiplexes on ?cmd=
+    if cmd:
+        path += f"?cmd={cmd[0]}"
+    return parts.hostname or "", path
+
+
+def _on_response(resp, *args, **kwargs):
+    host, endpoint = _endpoint(resp.url)
+    HTTP_SECONDS.observe(resp.elapsed.total_seconds(), host=host, endpoint=endpoint)
+    HTTP_REQUESTS.inc(host=host, endpoint=endpoint, status=resp.status_code)
+
+
+def instrument(session):
+    """Record every response of a `requests.Session` in the HTTP metrics."""
+    if _on_response not in session.hooks["response"]:
+        session.hooks["response"].append(_on_response)
+    return session
+
+
+def prometheus(extra: str = "") -> str:
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+        lines.extend(metric.prometheus())
+    return "\n".join(lines) + "\n" + extra
+
+
+def snapshot() -> dict:
+    return {m.name: m.snapshot() for m in _REGISTRY}
+
+
+def summary(since: Optional[dict] = None) -> dict:
+    """Return what was recorded since *since* (a `snapshot`) as plain JSON.
+
+    Metrics are process-wide, so in the service concurrent jobs can overlap.
+    """
+    since = since or {}
+    out = {}
+    for metric in _REGISTRY:
+        before = since.get(metric.name, {})
+        entries = {}
+        for key, value in metric.snapshot().items():
+            label = ",".join(f"{l}={v}" for l, v in zip(metric.labels, key) if v) or "total"
+            if isinstance(metric, Histogram):
+                s0, n0 = before.get(key, (0.0, 0))
+                if value[1] > n0:
+                    entries[label] = {"count": value[1] - n0, "seconds": round(value[0] - s0, 6)}
+            elif value > before.get(key, 0):
+                entries[label] = value - before.get(key, 0)
+        if entries:
+            out[metric.name] = entries
+    return out
+
+
+def summary_line(since: Optional[dict] = None, **extra) -> str:
+    """One compact JSON line – meant for logs, one per run."""
+    return json.dumps({**extra, **summary(since)}, separators=(",", ":"), default=str)
+
+
+@contextmanager
+def profiled(label: str, enabled: Optional[bool] = None):
+    """Run the block under cProfile and dump `<PROFILE_DIR>/<label>-<time>.prof`.
+
+    Off unless PROFILE_DIR is set or *enabled* is True (then the dump goes to
+    plex_rec_cache/profiles). Yields the output path, or None when off.
+    """
+    if enabled is None:
+        enabled = bool(PROFILE_DIR)
+    if not enabled:
+        yield None
+        return
+    out_dir = Path(PROFILE_DIR or Path("plex_rec_cache") / "profiles")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', label)}-{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}.prof"
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:           # another profile is running in this process
+        yield None
+        return
+    try:
+        yield path
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
@@ -0,0 +1,226 @@
+# neighbor_table.py
+# Precomputed item-to-item neighbours: the top NEIGHBOR_K cosine neighbours
+# of every library row and their scores, so a query is a table lookup and a
+# merge instead of a scan of the whole item matrix.
+#
+# The table is built block-wise – a bounded block of rows is scored against
+# the library at a time, on NEIGHBOR_WORKERS threads – and maintained in
+# place when rows are appended, renumbered or tombstoned (`remap`). It is
+# stored as one .npy of (id, score) pairs and memory-mapped on load.
+#
+# The same blocked scorer ranks arbitrary query rows (e.g. every user's
+# profile at once, `search_many`) with per-query exclusion masks.
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+
+from vector_index import _pad, _top_k
+
+load_dotenv(override=True)
+
+NEIGHBOR_K = int(os.getenv("NEIGHBOR_K", "50"))
+NEIGHBOR_WORKERS = int(os.getenv("NEIGHBOR_WORKERS", "0"))     # 0 → every core
+
+_BLOCK_BYTES = 64 << 20   # dense score block per worker
+_DENSE = 0.05             # columns set in more rows than this are scored with BLAS
+
+_DTYPE = np.dtype([("id", "<i4"), ("score", "<f4")])
+
+
+class _Scorer:
+    """Scores row blocks of *X* against a fixed set of *targets*.
+
+    Dense columns (numeric + SVD) go through one BLAS product and the sparse
+    genre/cast/director columns through a sparse one – far cheaper than a
+    sparse product whose result is dense anyway.
+    """
+
+    def __init__(self, X: sp.csr_matrix, targets: np.ndarray, exclude: Optional[np.ndarray]):
+        density = np.bincount(X.indices, minlength=X.shape[1]) / max(1, X.shape[0])
+        self.dense = density > _DENSE
+        self.X = X
+        self.targets = targets
+        T = X[targets]
+        self.TD = T[:, self.dense].toarray().T
+        self.TL = T[:, ~self.dense].T.tocsr()
+        self.blocked = exclude[targets] if exclude is not None else None
+        self.position = np.full(X.shape[0], -1, dtype=np.intp)
+        self.position[targets] = np.arange(len(targets))
+
+    def score(self, Q) -> np.ndarray:
+        """Dense (len(Q), n_targets) cosine block for query rows *Q* (sparse or dense)."""
+        if sp.issparse(Q):
+            S = Q[:, self.dense].toarray() @ self.TD
+            S += (Q[:, ~self.dense] @ self.TL).toarray()
+        else:
+            S = np.asarray(Q[:, self.dense], dtype=np.float32) @ self.TD
+            S += (sp.csr_matrix(Q[:, ~self.dense], dtype=np.float32) @ self.TL).toarray()
+        if self.blocked is not None:
+            S[:, self.blocked] = -np.inf
+        return S
+
+    def top(self, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        S = self.score(self.X[rows])
+        pos = self.position[rows]
+        own = pos >= 0
+        S[np.flatnonzero(own), pos[own]] = -np.inf          # never your own neighbour
+        local, scores = _top_k(S, k)
+        scores = scores.astype(np.float32)
+        ids = self.targets[local]
+        ids[~np.isfinite(scores)] = -1
+        return _pad(ids, scores, k)
+
+
+def _search(X: sp.csr_matrix, rows: np.ndarray, targets: np.ndarray, k: int,
+            exclude: Optional[np.ndarray] = None, workers: int = NEIGHBOR_WORKERS):
+    """Top-*k* of each of *rows* among *targets*, as `(ids, scores)` (n_rows, k)."""
+    ids = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    if len(rows) == 0 or len(targets) == 0 or k == 0:
+        return ids, scores
+    scorer = _Scorer(X, targets, exclude)
+    block = max(1, _BLOCK_BYTES // (4 * len(targets)))
+
+    def run(start):
+        part = rows[start:start + block]
+        ids[start:start + block], scores[start:start + block] = scorer.top(part, k)
+
+    # BLAS and scipy's sparse kernels release the GIL, so threads scale
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(run, range(0, len(rows), block)))
+    return ids, scores
+
+
+def search_many(X: sp.csr_matrix, Q, k: int, exclude: Optional[np.ndarray] = None,
+                masks: Optional[sp.csr_matrix] = None, workers: int = NEIGHBOR_WORKERS):
+    """Top-*k* rows of *X* for every query row of *Q*, as `(ids, scores)`.
+
+    *Q* is scored in blocks of rows (bounded memory, one BLAS product per
+    block, NEIGHBOR_WORKERS blocks at a time). *exclude* masks rows for every
+    query; *masks* is a sparse (n_queries, n_rows) matrix whose non-zeros mask
+    rows for that query only – e.g. each user's watched titles.
+    """
+    n_q = Q.shape[0]
+    ids = np.full((n_q, k), -1, dtype=np.intp)
+    scores = np.full((n_q, k), -np.inf, dtype=np.float32)
+    if n_q == 0 or X.shape[0] == 0 or k == 0:
+        return ids, scores
+    scorer = _Scorer(X, np.arange(X.shape[0]), exclude)
+    block = max(1, _BLOCK_BYTES // (4 * X.shape[0]))
+
+    def run(start):
+        S = scorer.score(Q[start:start + block])
+        if masks is not None:
+            hit_q, hit_row = masks[start:start + block].nonzero()
+            S[hit_q, hit_row] = -np.inf
+        top, best = _top_k(S, k)
+        best = best.astype(np.float32)
+        top[~np.isfinite(best)] = -1
+        ids[start:start + block], scores[start:start + block] = _pad(top, best, k)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(run, range(0, n_q, block)))
+    return ids, scores
+
+
+class NeighborTable:
+    """Each row's top-*k* neighbours, best first (id -1 / score -inf pads).
+
+    • `build(X)` – compute the whole table.
+    • `remap(X, mapping, exclude)` – follow rows renumbered, dropped or added.
+    • `lookup(rows, k, exclude)` – answer like `index.search`, from the table.
+    """
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.scores = scores
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @property
+    def k(self) -> int:
+        return self.ids.shape[1]
+
+    @classmethod
+    def build(cls, X: sp.csr_matrix, k: int = NEIGHBOR_K, exclude: Optional[np.ndarray] = None,
+              workers: int = NEIGHBOR_WORKERS):
+        every = np.arange(X.shape[0])
+        return cls(*_search(X, every, every, k, exclude, workers))
+
+    def remap(self, X: sp.csr_matrix, mapping: np.ndarray, exclude: Optional[np.ndarray] = None,
+              workers: int = NEIGHBOR_WORKERS):
+        """Return the table for *X* after its rows were renumbered.
+
+        • *mapping* gives the row of *X* each table row became, -1 if it is
+          gone; entries pointing at gone rows are dropped;
+        • rows of *X* no table row maps to are new: they get their own
+          lists, and enter the lists of the kept rows they beat;
+        • rows left with fewer than k/2 live neighbours by tombstones
+          (*exclude*) or dropped entries are recomputed.
+        """
+        mapping = np.asarray(mapping, dtype=np.intp)
+        n, k = X.shape[0], self.k
+        live = np.ones(n, bool) if exclude is None else ~np.asarray(exclude, bool)
+        every = np.arange(n)
+        kept = np.flatnonzero(mapping >= 0)
+        old = mapping[kept]
+        fresh = np.ones(n, bool)
+        fresh[old] = False
+        new = np.flatnonzero(fresh)
+
+        ids = np.full((n, k), -1, dtype=np.int32)
+        scores = np.full((n, k), -np.inf, dtype=np.float32)
+        held_ids = np.asarray(self.ids[kept], dtype=np.intp)   # the loaded table is a read-only map
+        held_ids = np.where(held_ids >= 0, mapping[np.maximum(held_ids, 0)], -1)
+        ids[old] = held_ids
+        scores[old] = np.where(held_ids >= 0, self.scores[kept], -np.inf)
+
+        if len(new):
+            ids[new], scores[new] = _search(X, new, every, k, exclude, workers)
+            cand_ids, cand_scores = _search(X, old, new, k, exclude, workers)
+            merged = np.hstack([scores[old], cand_scores])
+            order = np.argsort(-merged, axis=1, kind="stable")[:, :k]
+            ids[old] = np.take_along_axis(np.hstack([ids[old], cand_ids]), order, axis=1)
+            scores[old] = np.take_along_axis(merged, order, axis=1)
+
+        held = ((ids >= 0) & live[np.maximum(ids, 0)]).sum(axis=1)
+        short = np.flatnonzero(live & (held < min(k // 2, live.sum() - 1)))
+        if len(short):
+            ids[short], scores[short] = _search(X, short, every, k, exclude, workers)
+        return NeighborTable(ids, scores)
+
+    def lookup(self, rows, k: int, exclude: Optional[np.ndarray] = None):
+        """Return `(ids, scores)` of shape (len(rows), k) for table rows *rows*."""
+        rows = np.asarray(rows, dtype=np.intp)
+        ids = np.asarray(self.ids[rows], dtype=np.intp)
+        scores = np.array(self.scores[rows], dtype=np.float32)
+        if exclude is not None:
+            scores[(ids >= 0) & exclude[np.maximum(ids, 0)]] = -np.inf
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        ids = np.take_along_axis(ids, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        ids[~np.isfinite(scores)] = -1
+        return _pad(ids, scores, k)
+
+    def save(self, path: Path):
+        """Write the table next to *path* and rename it into place."""
+        path = Path(path)
+        table = np.empty(self.ids.shape, dtype=_DTYPE)
+        table["id"] = self.ids
+        table["score"] = self.scores
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            np.save(fh, table)
+        os.replace(tmp, path)
+
+
+def load_table(path: Path) -> NeighborTable:
+    """Map a table written by `NeighborTable.save` read-only."""
+    table = np.load(path, mmap_mode="r")
+    return NeighborTable(table["id"], table["score"])
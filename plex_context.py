@@ -0,0 +1,163 @@
+# plex_context.py
+# One shared set of Plex / plex.tv connections per process.
+#
+# Servers and accounts are created lazily on pooled keep-alive sessions, and
+# the plex.tv lookups every push needs – the users list, display names,
+# server-specific user tokens and switched Home-user accounts – are cached
+# for PLEX_CONTEXT_TTL seconds. A 401 drops the cache and retries once, so a
+# revoked or rotated token heals itself on the next call.
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from plexapi.exceptions import Unauthorized
+from plexapi.myplex import MyPlexAccount
+from plexapi.server import PlexServer
+
+import metrics
+
+load_dotenv(override=True)
+
+PLEX_BASE_URL = os.getenv("PLEX_BASE_URL")
+PLEX_TOKEN = os.getenv("PLEX_TOKEN")
+PLEX_CONTEXT_TTL = float(os.getenv("PLEX_CONTEXT_TTL", "3600"))   # seconds
+
+
+def _session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return metrics.instrument(session)
+
+
+class PlexContext:
+    """Lazily opened Plex connections plus TTL-cached plex.tv lookups.
+
+    • `server` / `account` – the owner's server and plex.tv account.
+    • `user_server(token)` – a server connection per user token.
+    • `users`, `display_name`, `server_token`, `home_account` – cached for
+      *ttl* seconds; in steady state a push makes no plex.tv request at all.
+    • `retry(fn, ...)` – run *fn*, and on a 401 reset the cache and run it again.
+    """
+
+    def __init__(self, base_url: Optional[str] = PLEX_BASE_URL,
+                 token: Optional[str] = PLEX_TOKEN, ttl: float = PLEX_CONTEXT_TTL):
+        self.base_url = base_url
+        self.token = token
+        self.ttl = ttl
+        self.pms_session = _session()
+        self.tv_session = _session()
+        self._cache: Dict[Tuple, Tuple[float, object]] = {}
+        self._lock = threading.Lock()
+
+    def _memo(self, key: Tuple, make: Callable, ttl: Optional[float] = None):
+        """Return the cached value for *key*, calling *make* when missing or
+        older than *ttl* (``None`` = keep until `reset`)."""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None and hit[0] > now:
+                return hit[1]
+        value = make()
+        expires = now + ttl if ttl is not None else float("inf")
+        with self._lock:
+            self._cache[key] = (expires, value)
+        return value
+
+    def reset(self):
+        """Forget every connection and lookup (e.g. after a 401)."""
+        with self._lock:
+            self._cache.clear()
+
+    def retry(self, fn: Callable, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Unauthorized:
+            self.reset()
+            return fn(*args, **kwargs)
+
+    # connections ----------------------------------------------------------
+    def server(self) -> PlexServer:
+        return self.user_server(self.token)
+
+    def user_server(self, token: str) -> PlexServer:
+        return self._memo(("server", token),
+                          lambda: PlexServer(self.base_url, token, session=self.pms_session))
+
+    def account(self) -> MyPlexAccount:
+        return self._memo(("account",),
+                          lambda: MyPlexAccount(token=self.token, session=self.tv_session))
+
+    # plex.tv lookups ------------------------------------------------------
+    def users(self) -> list:
+        """Friends and managed Home users of the owner account."""
+        return self._memo(("users",), lambda: self.account().users(), self.ttl)
+
+    def is_owner(self, name: str) -> bool:
+        acc = self.account()
+        return name.lower() in {(acc.username or "").lower(), (getattr(acc, "title", "") or "").lower(),
+                                (acc.email or "").lower()}
+
+    def find_user(self, name: str):
+        """Return the user whose title (display name) or username is *name*."""
+        low = name.lower()
+        for u in self.users():
+            if low in {(u.title or "").lower(), (getattr(u, "username", "") or "").lower()}:
+                return u
+        return None
+
+    def display_name(self, username: str) -> str:
+        if self.account().username == username:
+            return username
+        for user in self.users():
+            if username == user.username:
+                return user.title
+        raise RuntimeError(f"Cannot obtain title for user {username!r}. Available users: "
+                           f"{[u.username for u in self.users()]}")
+
+    def server_token(self, username: str) -> str:
+        """Return a *server-specific* token for *username* (owner, friend or Home user)."""
+        if self.is_owner(username):
+            return self.token
+
+        def fetch():
+            user = self.find_user(username)
+            token = user and (user.get_token(self.server().machineIdentifier)
+                              or getattr(user, "authenticationToken", None))
+            if not token:
+                raise RuntimeError(f"Cannot obtain token for user {username!r}. Available users: "
+                                   f"{[u.title for u in self.users()]}")
+            return token
+
+        return self._memo(("token", username.lower()), fetch, self.ttl)
+
+    def home_account(self, name: str) -> MyPlexAccount:
+        """Return a plex.tv-authenticated account for *name* (owner or Home user)."""
+        if self.is_owner(name):
+            return self.account()
+
+        def switch():
+            user = self.find_user(name)
+            if user is None:
+                raise RuntimeError(f"No Plex Home user named {name!r}")
+            return self.account().switchHomeUser(user)   # ⇢ account token
+
+        return self._memo(("home", name.lower()), switch, self.ttl)
+
+
+_context: Optional[PlexContext] = None
+_context_lock = threading.Lock()
+
+
+def context() -> PlexContext:
+    """Return the process-wide `PlexContext`, creating it on first use."""
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = PlexContext()
+        return _context
@@ -2,16 +2,20 @@ from plexapi.myplex import MyPlexAccount
 from plexapi.server  import PlexServer, NotFound
 from plexapi.video import Movie, Show
 from plexapi.exceptions import BadRequest
-from rec_engine import recommend_from_seeds
-from typing import List
+from rec_engine import recommend_for_user, recommend_from_seeds
+from gen_recs import section_type
+from typing import List, Optional, Union
+import bisect
+import pandas as pd
 from tautulli import get_recently_watched
+from push_state import PushState, fingerprint
+from plex_context import context
+import metrics
 from dotenv import load_dotenv
 import os
 
 load_dotenv(override=True)
 
-BASE_URL = os.getenv("PLEX_BASE_URL")
-PLEX_TOKEN = os.getenv("PLEX_TOKEN")
 USE_WATCHLIST = os.getenv("WATCHLIST", "False").lower() in ("true", 1)
 PLAYLIST_TPL: str = "Fresh {kind} Recs for {name}"                     # for movies
 COLLECTION_TPL: str = "Fresh {kind} Recs for {name}"                   # for shows
@@ -71,165 +75,260 @@ def _pick_items(titles: list[str], plex_srv: PlexServer, kind: str):
         items.append(chosen)
     return items
 
-def _user_token(account: MyPlexAccount, machine_id: str, username: str) -> str:
-    """Return a *server‑specific* token for **username**.
+def _resolve_items(recs: Union[pd.DataFrame, List[str]], plex_srv: PlexServer, kind: str):
+    """Turn recommendations into Plex media objects, in *recs* order.
 
-    • Works for the server owner them‑self, friends, and managed Plex‑Home users.
-    • Accepts either the **username** shown in Plex or the *display name*
-      (what Tautulli calls *username* in its payload).
+    Library recommendations carry their `rating_key`, so they are all fetched
+    in one `/library/metadata/<k1,k2,…>` request. Only rows without a key
+    (catalog candidates, plain title lists) or whose item has since left the
+    server fall back to the title search in `_pick_items`.
     """
-    # 0) Owner wants a playlist too?  Their token is the one we already have.
-    if username.lower() in {account.username.lower(), getattr(account, "title", "").lower()}:
-        return PLEX_TOKEN
-
-    # 1) scan friends & home users – their "title" matches the display name
-    for u in account.users():
-        if username.lower() in {u.title.lower(), getattr(u, "username", "").lower()}:
-            token = u.get_token(machine_id) or getattr(u, "authenticationToken", None)
-            if token:
-                return token
-
-    raise RuntimeError(f"Cannot obtain token for user {username!r}. Available users: "
-                       f"{[u.title for u in account.users()]}")
-
-def _get_account(owner_acc: MyPlexAccount, name: str) -> MyPlexAccount:
-    """Return a plex.tv-authenticated account for *name* (owner or Home user)."""
-    low = name.lower()
-    if low in (owner_acc.username.lower(), owner_acc.email.lower()):
-        return owner_acc                       # you
-
-    # Managed Plex-Home profiles
-    for u in owner_acc.users():
-        if low in (u.title.lower(), u.username.lower()):
-            return owner_acc.switchHomeUser(u)   # ⇢ account token
-
-    raise RuntimeError(f"No Plex Home user named {name!r}")
-
-def add_unique_to_watchlist(account, items):
-    unique = [itm for itm in items if not account.onWatchlist(itm)]
-    if not unique:
-        return 0
+    if not isinstance(recs, pd.DataFrame):
+        recs = pd.DataFrame({"title": list(recs)})
+    keys = recs["rating_key"] if "rating_key" in recs.columns else pd.Series(index=recs.index, dtype=float)
+
+    wanted = [int(k) for k in keys.dropna()]
+    by_key = {}
+    with metrics.stage("resolve_items"):
+        if wanted:
+            try:
+                by_key = {int(item.ratingKey): item for item in plex_srv.fetchItems(wanted)}
+            except NotFound:
+                pass
+
+        items = []
+        for title, key in zip(recs["title"], keys):
+            item = by_key.get(int(key)) if pd.notna(key) else None
+            if item is None:
+                item = next(iter(_pick_items([title], plex_srv, kind)), None)
+            if item is not None:
+                items.append(item)
+    return items
+
+def _watchlist_action(account: MyPlexAccount, action: str, guid: str) -> bool:
+    """Run one plex.tv watchlist *action* for *guid* – no `onWatchlist` probe,
+    the caller has already diffed against a single watchlist listing."""
     try:
-        account.addToWatchlist(unique)
-        return len(unique)
+        metrics.PLEX_WRITES.inc(op=action)
+        account.query(f"{account.METADATA}/actions/{action}?ratingKey={guid.rsplit('/', 1)[-1]}",
+                      method=account._session.put)
+        return True
     except BadRequest as exc:
-        print(f"Watch-list add failed: {exc}")
-        return 0
+        print(f"Watch-list {action} failed: {exc}")
+        return False
 
-def push_watchlist(username: str, seeds: list[str], kind: str):
-    owner_srv = PlexServer(BASE_URL, PLEX_TOKEN)
-    owner_acc = MyPlexAccount(token=PLEX_TOKEN)
+def add_unique_to_watchlist(account, items, current=None) -> list[str]:
+    """Add the *items* not already on the watchlist; return the guids added.
 
-    friend_acc = _get_account(owner_acc, username)
+    *current* is the set of guids already listed (fetched here when omitted),
+    so the whole check costs one request instead of one per item.
+    """
+    if current is None:
+        current = {itm.guid for itm in account.watchlist()}
+    unique = [itm for itm in items
+              if itm.guid not in current and (itm.guid or "").startswith("plex://")]
+    return [itm.guid for itm in unique if _watchlist_action(account, "addToWatchlist", itm.guid)]
+
+def push_watchlist(username: str, seeds: Union[pd.DataFrame, list[str]], kind: str,
+                   previous=()) -> list[str]:
+    """Sync *username*'s watch-list with the recommendations in *seeds*.
+
+    Entries from an earlier push (*previous* guids) that are no longer
+    recommended are removed; anything the user added themselves is left
+    alone. Returns the guids this and earlier pushes put there that are
+    still listed, for the next call's *previous*.
+    """
+    previous = set(previous)
+    owner_srv = context().server()
+    friend_acc = context().home_account(username)
 
-    items = _pick_items(seeds, owner_srv, kind)
+    items = _resolve_items(seeds, owner_srv, kind)
     if not items:
         print("No matches in library, nothing to add")
-        return
-    
-    added = add_unique_to_watchlist(friend_acc, items)
-    print(f"Added {added} new titles to {username}'s watch-list")
-
-#for movies
-def _movie_section(plex_srv: PlexServer):
-    """Return the first library section of type 'movie'."""
-    return next(s for s in plex_srv.library.sections() if s.type == "movie")
-
-def _push_movie_collection(owner_srv: PlexServer, plex_u: PlexServer, titles: list[str], username: str, user_title: str):
-    items = _pick_items(titles, owner_srv, "movie")
-    if not items:
-        print("Movie titles not found in library – nothing added.")
-        return
-    
-    movie_sec = _movie_section(owner_srv)  # collection must be created with owner perms
-    name = COLLECTION_TPL.format(kind="Movie", name=user_title)
-
-    try:
-        coll = movie_sec.collection(name)
-        coll.removeItems(coll.items())
-        coll.addItems(items)
-        print(f"Collection '{name}' updated ({len(items)} items).")
-    except NotFound:
-        coll = movie_sec.createCollection(name, items=items)
-        print(f"Collection '{name}' created ({len(items)} items).")
-
-    # Promote on Home for just this user (if desired and supported)
+        return sorted(previous)
+
+    current = {itm.guid for itm in friend_acc.watchlist()}
+    wanted = {itm.guid for itm in items}
+    stale = [guid for guid in previous if guid in current and guid not in wanted]
+    # a removal that failed stays ours, to retry next time
+    kept = [guid for guid in stale if not _watchlist_action(friend_acc, "removeFromWatchlist", guid)]
+    added = add_unique_to_watchlist(friend_acc, items, current)
+    print(f"Added {len(added)} new titles to {username}'s watch-list "
+          f"({len(stale) - len(kept)} stale removed)")
+    # titles already listed before we pushed them may be the user's own – never claim those
+    return sorted(set(added) | (previous & wanted & current) | set(kept))
+
+def _promote(coll):
+    """Promote *coll* on Home for just this user (if desired and supported)."""
     if HOME_PROMOTE:
         try:
             hub = coll.visibility()
+            metrics.PLEX_WRITES.inc(op="promote")
             hub.updateVisibility(home=True, recommended=True, shared=False)
         except Exception as exc:
+            # older Plex servers / tokens may not support per‑user promotion
             print(f"Home promotion skipped: {exc}")
 
-#for tv
-def _tv_section(plex_srv: PlexServer):
-    """Return the first library section of type 'show'."""
-    return next(s for s in plex_srv.library.sections() if s.type == "show")
-
-
-def _push_tv_collection(owner_srv: PlexServer, plex_u: PlexServer, titles: list[str], username: str, user_title: str):
-    items = _pick_items(titles, owner_srv, "tv")
-    if not items:
-        print("Show titles not found in library – nothing added.")
-        return
-    
-    tv_sec = _tv_section(owner_srv)  # collection must be created with owner perms
-    name = COLLECTION_TPL.format(kind="TV", name=user_title)
-
+def _in_order(order: list, wanted: list) -> set:
+    """Return the keys of *wanted* that can stay put: the longest subsequence
+    already in *wanted* order within *order*. Everything else needs one move."""
+    pos = {key: i for i, key in enumerate(order)}
+    tails, tail_idx, prev = [], [], [-1] * len(wanted)
+    for i, key in enumerate(wanted):
+        j = bisect.bisect_left(tails, pos[key])
+        if j == len(tails):
+            tails.append(pos[key])
+            tail_idx.append(i)
+        else:
+            tails[j] = pos[key]
+            tail_idx[j] = i
+        prev[i] = tail_idx[j - 1] if j else -1
+    stay, i = set(), tail_idx[-1] if tail_idx else -1
+    while i >= 0:
+        stay.add(wanted[i])
+        i = prev[i]
+    return stay
+
+def _sync_collection(section, name: str, items: list):
+    """Make collection *name* hold exactly *items*, in order, with minimal writes.
+
+    • A new collection is created with every item in one request, switched to
+      custom order and promoted – once.
+    • An existing one gets one batched add for the new items, a delete per
+      stale item, and the fewest moves that restore the order.
+    """
+    items = list({itm.ratingKey: itm for itm in items}.values())
     try:
-        coll = tv_sec.collection(name)
-        coll.removeItems(coll.items())
-        coll.addItems(items)
-        print(f"Collection '{name}' updated ({len(items)} items).")
+        coll = section.collection(name)
     except NotFound:
-        coll = tv_sec.createCollection(name, items=items)
+        coll = section.createCollection(name, items=items)
+        coll.sortUpdate("custom")
+        metrics.PLEX_WRITES.inc(op="create")
+        metrics.PLEX_WRITES.inc(op="sort")
         print(f"Collection '{name}' created ({len(items)} items).")
+        _promote(coll)
+        return
 
-    # Promote on Home for just this user (if desired and supported)
-    if HOME_PROMOTE:
+    current = coll.items()
+    wanted = {itm.ratingKey for itm in items}
+    have = {itm.ratingKey for itm in current}
+    stale = [itm for itm in current if itm.ratingKey not in wanted]
+    new = [itm for itm in items if itm.ratingKey not in have]
+    if stale:
+        coll.removeItems(stale)
+        metrics.PLEX_WRITES.inc(len(stale), op="remove")
+    if new:
+        coll.addItems(new)
+        metrics.PLEX_WRITES.inc(op="add")
+
+    # custom order: removed items are gone, new ones were appended at the end
+    order = [itm.ratingKey for itm in current if itm.ratingKey in wanted] + [itm.ratingKey for itm in new]
+    stay = _in_order(order, [itm.ratingKey for itm in items])
+    if len(stay) < len(items) and getattr(coll, "collectionSort", 2) != 2:
+        coll.sortUpdate("custom")
+        metrics.PLEX_WRITES.inc(op="sort")
+    moved = 0
+    for pos, itm in enumerate(items):
+        if itm.ratingKey not in stay:
+            # everything before *pos* is already in place, so one move each
+            coll.moveItem(itm, after=items[pos - 1] if pos else None)
+            moved += 1
+    metrics.PLEX_WRITES.inc(moved, op="move")
+    print(f"Collection '{name}' updated (+{len(new)} -{len(stale)}, {moved} moved).")
+
+def _push_collections(owner_srv: PlexServer, recs: pd.DataFrame, kind: str, user_title: str):
+    """Sync the user's collection in every *kind* section that holds some of
+    the recommendations (a Plex collection lives in one section); sections
+    left without any get their collection deleted."""
+    label = "Movie" if kind == "movie" else "TV"
+    items = _resolve_items(recs, owner_srv, kind)
+    if not items:
+        print(f"{label} titles not found in library – nothing added.")
+        return False
+
+    name = COLLECTION_TPL.format(kind=label, name=user_title)
+    by_section = {}
+    for itm in items:
+        by_section.setdefault(int(itm.librarySectionID), []).append(itm)
+    # collections must be created with owner perms
+    for section in owner_srv.library.sections():
+        if section.type != section_type(kind):
+            continue
+        if int(section.key) in by_section:
+            _sync_collection(section, name, by_section[int(section.key)])
+            continue
         try:
-            hub = coll.visibility()
-            hub.updateVisibility(home=True, recommended=True, shared=False)
-        except Exception as exc:
-            # older Plex servers / tokens may not support per‑user promotion
-            print(f"Home promotion skipped: {exc}")
-
-def push_recs(username: str, seeds: List[str], kind: str):
+            section.collection(name).delete()
+        except NotFound:
+            continue
+        metrics.PLEX_WRITES.inc(op="delete")
+        print(f"Collection '{name}' removed from '{section.title}'.")
+    return True
+
+def push_recs(username: str, seeds: List[str], kind: str, watched_at: Optional[list] = None,
+              recs: Optional[pd.DataFrame] = None):
+    """Recommend for *username* and push the result to Plex.
+
+    With *watched_at* (one timestamp per seed, as `get_recently_watched`
+    returns them) the recommendations come from the user's taste profile;
+    without it every seed is queried on its own. Already computed *recs*
+    (e.g. from `recommend_for_users`) are pushed as they are.
+    """
     if kind not in {"movie", "tv"}:
         raise ValueError("kind must be 'movie' or 'tv'")
+    # a stale cached token (401) is dropped and the push retried once
+    context().retry(_push_recs, username, seeds, kind, watched_at, recs)
 
-    # owner context to fetch machine ID & manage collections
-    owner_srv = PlexServer(BASE_URL, PLEX_TOKEN)
-    machine_id = owner_srv.machineIdentifier
-    account = MyPlexAccount(token=PLEX_TOKEN)
-
-    # connect as recipient user (for searches/playlists)
-    user_token = _user_token(account, machine_id, username)
-    plex_u = PlexServer(BASE_URL, user_token)
-    user_title = get_name(username, account)
+def _push_recs(username: str, seeds: List[str], kind: str, watched_at: Optional[list] = None,
+               recs: Optional[pd.DataFrame] = None):
+    ctx = context()
+    with metrics.stage("plex_context"):
+        # owner context to manage collections
+        owner_srv = ctx.server()
+        user_title = ctx.display_name(username)
 
     # build recommendations
-    recs = recommend_from_seeds(seeds, kind)
+    with metrics.stage("recommend"):
+        if recs is None and watched_at is None:
+            recs = recommend_from_seeds(seeds, kind)
+        elif recs is None:
+            watched = pd.DataFrame({"title": seeds, "watched_at": watched_at})
+            recs = recommend_for_user(username, watched, kind)
     if recs.empty:
         print("No recommendations produced – nothing to update.")
+        metrics.PUSHES.inc(kind=kind, result="no_recs")
         return
 
-    if (not USE_WATCHLIST):
-        if kind == "movie":
-            _push_movie_collection(owner_srv, plex_u, recs["title"].tolist(), username, user_title)
-        else:
-            _push_tv_collection(owner_srv, plex_u, recs["title"].tolist(), username, user_title)
+    # same recommendations as last time → no Plex writes at all
+    if USE_WATCHLIST:
+        target = "watchlist"
     else:
-        push_watchlist(username, recs["title"].tolist(), kind)
-
-def get_name(username: str, account: MyPlexAccount):
-    if (account.username == username):
-        return username
-    for user in account.users():
-        if (username == user.username):
-            return user.title
-    raise RuntimeError(f"Cannot obtain title for user {username!r}. Available users: "
-                       f"{[u.username for u in account.users()]}")
+        target = COLLECTION_TPL.format(kind="Movie" if kind == "movie" else "TV", name=user_title)
+    keys = recs["rating_key"] if "rating_key" in recs.columns else pd.Series(index=recs.index, dtype=float)
+    fp = fingerprint(target, [int(k) if pd.notna(k) else t for t, k in zip(recs["title"], keys)])
+    state = PushState()
+    try:
+        if state.unchanged(username, kind, fp):
+            print(f"Recommendations for {username} unchanged – nothing to push.")
+            metrics.PUSHES.inc(kind=kind, result="unchanged")
+            return
+
+        with metrics.stage("plex_write"):
+            if (not USE_WATCHLIST):
+                done = _push_collections(owner_srv, recs, kind, user_title)
+                pushed = ()
+            else:
+                pushed = push_watchlist(username, recs, kind, previous=state.pushed(username, kind))
+                done = bool(pushed)
+        metrics.PUSHES.inc(kind=kind, result="pushed" if done else "no_items")
+        if done:
+            state.record(username, kind, fp, pushed)
+    finally:
+        state.close()
+
+def get_name(username: str, account: MyPlexAccount = None):
+    """Return the display name of *username* (cached – see `PlexContext`)."""
+    return context().display_name(username)
 
 
 if __name__ == "__main__":
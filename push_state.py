@@ -0,0 +1,71 @@
+# push_state.py
+# What was last pushed to each user's collection / watchlist, so repeated
+# events with the same recommendations cost no Plex writes at all.
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+_PUSH_DB = Path("plex_rec_cache") / "pushes.sqlite"
+
+
+def fingerprint(target: str, entries: Iterable) -> str:
+    """Return a digest of *target* (collection name / 'watchlist') and the
+    ordered *entries* – rating keys, or titles for rows without one."""
+    h = hashlib.sha1(target.encode())
+    for entry in entries:
+        h.update(b"\0" + str(entry).encode())
+    return h.hexdigest()
+
+
+class PushState:
+    """SQLite table of the last successful push per ``(username, kind)``.
+
+    • `unchanged` tells whether *fingerprint* matches the stored one.
+    • `pushed` returns the identities written last time (watchlist guids),
+      so only entries we added ourselves are ever removed again.
+    """
+
+    def __init__(self, path: Path = _PUSH_DB):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS pushes (
+                   username    TEXT NOT NULL,
+                   kind        TEXT NOT NULL,
+                   fingerprint TEXT NOT NULL,
+                   items       TEXT NOT NULL,
+                   pushed_at   REAL NOT NULL,
+                   PRIMARY KEY (username, kind)
+               )"""
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _row(self, username: str, kind: str) -> Optional[tuple]:
+        return self.conn.execute(
+            "SELECT fingerprint, items FROM pushes WHERE username = ? AND kind = ?",
+            (username, kind),
+        ).fetchone()
+
+    def unchanged(self, username: str, kind: str, fingerprint: str) -> bool:
+        row = self._row(username, kind)
+        return row is not None and row[0] == fingerprint
+
+    def pushed(self, username: str, kind: str) -> List[str]:
+        row = self._row(username, kind)
+        return json.loads(row[1]) if row else []
+
+    def record(self, username: str, kind: str, fingerprint: str, items: Iterable[str] = ()):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pushes (username, kind, fingerprint, items, pushed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (username, kind, fingerprint, json.dumps(list(items)), time.time()),
+        )
+        self.conn.commit()
@@ -1,75 +1,779 @@
 # rec_engine.py  (NEW)
 # requires - pyarrow, fastparquet
-from typing import List, Tuple
+#
+# The cache is sharded by Plex library section: every movie / show section
+# ("movie-1", "movie-7" for a 4K library, ...) has its own data frame, item
+# matrix, index and change tracking, so a change in one section only
+# touches that shard. All shards of a kind share one frozen feature space,
+# and queries run on their merged view (`shards.stack`). Stale shards are
+# brought up to date in parallel worker processes; the kind's neighbour
+# table spans every shard and follows them in place (`_neighbors`).
+#
+# Every build writes a new generation directory (plex_rec_cache/<kind>/gen-*)
+# and then switches the `current` pointer, so queries keep being served from
+# the previous generation while a rebuild runs in the background. Builds are
+# single-flight across processes (a file lock per kind), and a generation's
+# manifest lets a torn or damaged cache be detected instead of loaded.
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
 import pandas as pd
 from pathlib import Path
-from gen_recs import Movie, TVShow, Model, fetch_plex_list   # uses your existing code
+from dotenv import load_dotenv
+from gen_recs import Movie, TVShow, Model, FeatureSpace   # uses your existing code
+import library_watch
+import shards
+from file_lock import file_lock
+import plex_context
+from plex_context import context
+from tmdb_store import MetaStore, meta_key
+import tmdb_client
+from tmdb_client import get_client
+from vector_index import load_index
+from neighbor_table import NeighborTable, load_table
+from vector_store import open_matrix, save_matrix
+from tmdb_catalog import Catalog
+from user_profile import Profile, ProfileStore
+import metrics
 import numpy as np
+import scipy.sparse as sp
 import joblib
 
-_CACHE = Path("plex_rec_cache")          # or any writable folder
-_CACHE.mkdir(exist_ok=True)
+load_dotenv(override=True)
 
-def _paths(kind: str):
-    """Return cache file paths for *kind* ('movie' | 'tv')."""
+log = logging.getLogger(__name__)
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))   # 0 → one process per stale section, up to the core count
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", "600"))   # seconds a query waits for another process's build
+CACHE_VERIFY = os.getenv("CACHE_VERIFY", "size").lower()             # size | checksum – checked on every cold load
+
+_CACHE = Path("plex_rec_cache")          # or any writable folder – created on first use
+_META_DB = _CACHE / "tmdb_meta.sqlite"   # survives cache rebuilds
+_CHECKPOINT_EVERY = 50                   # enriched rows per store commit
+
+# incremental updates fall back to a rebuild past these limits
+_DRIFT_MAX = 0.2          # unseen genre/cast/director labels among appended rows
+_APPEND_MAX = 0.5         # appended rows, relative to the fitted shard size
+_TOMBSTONE_MAX = 0.25     # removed-but-kept rows, relative to all rows
+
+# the only df columns the query path reads; the rest stay on disk
+_SERVE_COLUMNS = ["title", "key", "removed", "rating_key"]
+
+# kind -> (generation, (df, X, knn, table), {title: row}); lets a long-running
+# process skip re-opening the cache while the current generation is unchanged
+_LOADED = {}
+
+# kind -> (generation, (df, X, knn, table), {title: row}) pinned by `pinned()`;
+# skips the library check entirely
+_PINNED = {}
+
+# set by one-shot processes (the Tautulli hook, which Tautulli kills after
+# about 30 s): background rebuilds then run in a detached process instead
+DETACH_REFRESH = False
+_DETACHED = set()         # kinds this process already handed off
+
+# background rebuilds: kind -> running thread, and kinds asked for again meanwhile
+_REFRESHING = {}
+_AGAIN = set()
+_REFRESH_LOCK = threading.Lock()
+
+
+class _Refit(Exception):
+    """A shard no longer fits the kind's feature space; refit it on every section."""
+
+
+class _Corrupt(Exception):
+    """A generation's files don't match its manifest."""
+
+
+def _current(kind: str) -> Optional[Path]:
+    """Return the directory of the *kind* generation queries are served from."""
+    try:
+        gen = _CACHE / kind / (_CACHE / kind / "current").read_text().strip()
+    except FileNotFoundError:
+        return None
+    return gen if gen.is_dir() else None
+
+
+def _point(kind: str, gen: Path):
+    """Switch *kind* to generation *gen* – one atomic rename."""
+    pointer = _CACHE / kind / "current"
+    tmp = pointer.with_name("current.tmp")
+    tmp.write_text(gen.name)
+    os.replace(tmp, pointer)
+
+
+def _kind_paths(gen: Path):
+    """Return the files shared by every shard of generation *gen*."""
+    return {
+        "space": gen / "space.joblib",
+        "model": gen / "model.txt",     # id of the fitted space, for user profiles
+        "neighbors": gen / "neighbors.npy",   # over every shard, in section order
+    }
+
+
+def _shard(kind: str, section: dict) -> str:
+    return f"{kind}-{section['key']}"
+
+
+def _paths(gen: Path, shard: str):
+    """Return cache file paths for *shard* ('movie-1', 'tv-2', ...) in generation *gen*."""
     return {
-        "df":    _CACHE / f"{kind}_df.parquet",
-        "X":     _CACHE / f"{kind}_X.npy",
-        "knn":   _CACHE / f"{kind}_knn.joblib",
-        "count": _CACHE / f"{kind}_count.txt",
+        "df":    gen / f"{shard}_df.parquet",
+        "X":     gen / f"{shard}_X.vec",
+        "index": gen / f"{shard}_index.npz",
+        "drift": gen / f"{shard}_drift.json",   # rows fitted / appended, labels seen / unseen
+        "signature": gen / f"{shard}_signature.txt",
+        "snapshot": gen / f"{shard}_snapshot.json",   # library_watch's, for the next delta
     }
 
 
-def _delete_cache(kind: str):
-    for p in _paths(kind).values():
+def _has_cache(paths: dict) -> bool:
+    return all(p.exists() for k, p in paths.items() if k not in {"signature", "snapshot"})
+
+
+def _shards_in(gen: Path, kind: str) -> List[str]:
+    """Shard names of *kind* in generation *gen*, in section order."""
+    names = [p.name.split("_", 1)[0] for p in gen.glob(f"{kind}-*_df.parquet")]
+    return sorted(names, key=lambda name: int(name.split("-", 1)[1]))
+
+
+def _link(src: Path, dest: Path, shard: str):
+    """Carry *shard*'s files from generation *src* over to *dest* (hard links:
+    published generations are never written to)."""
+    for p in src.glob(f"{shard}_*"):
+        target = dest / p.name
+        if target.exists() or target not in _paths(dest, shard).values():   # e.g. an older layout's
+            continue
         try:
-            p.unlink()
-        except FileNotFoundError:
-            pass
+            os.link(p, target)
+        except OSError:
+            shutil.copy2(p, target)
 
-def _build(kind: str, *, force: bool = False) -> Tuple[pd.DataFrame, np.ndarray, joblib.Memory]:
-    """Return `(df, X, knn)` for *kind* ('movie' | 'tv').
 
-    If cache exists **and** library size hasn’t changed, loads from disk.
-    Otherwise, rebuilds from scratch and overwrites the cache.
+def _prune_generations(kind: str):
+    """Drop generations older than the previous one (a reader may still be on it),
+    and the pre-generation flat cache files."""
+    gens = sorted((p for p in (_CACHE / kind).glob("gen-*") if not p.name.endswith(".tmp")),
+                  key=lambda p: p.stat().st_mtime)
+    current = _current(kind)
+    for old in gens[:-2]:
+        if old != current:
+            shutil.rmtree(old, ignore_errors=True)   # open maps stay valid on POSIX
+    for p in [*_CACHE.glob(f"{kind}-*"), *_CACHE.glob(f"{kind}_*")]:
+        p.unlink(missing_ok=True)
+
+def _enrich(kind: str, lib_df: pd.DataFrame) -> pd.DataFrame:
+    """Return TMDB metadata for every row of *lib_df*, in the same order.
+
+    Only ids that are new or expired in the metadata store hit TMDB; results
+    are checkpointed every `_CHECKPOINT_EVERY` rows so an interrupted build
+    resumes where it stopped. Ids TMDB doesn't know get an empty row for
+    this build only – it is never stored, so they are asked for again.
     """
-    paths = _paths(kind)
-
-    # fetch current library list once; we need its length anyway
-    lib_df = fetch_plex_list(media_type=kind)
-    cur_len = len(lib_df)
-
-    # decide whether cache is valid
-    cache_ok = (
-        not force
-        and all(p.exists() for k, p in paths.items() if k != "count")
-        and paths["count"].exists()
-        and int(paths["count"].read_text()) == cur_len
-    )
+    keys = [meta_key(row) for _, row in lib_df.iterrows()]
+    store = MetaStore(_META_DB)
+    try:
+        have = store.get_many(kind, keys)
+        missing = [k for k in dict.fromkeys(keys) if k not in have]
+        metrics.ENRICHED.inc(len(have), kind=kind, source="store")
+        metrics.ENRICHED.inc(len(missing), kind=kind, source="tmdb")
+
+        enricher = Movie() if kind == "movie" else TVShow()
+        blank = enricher.parse({})
+        batch = {}
+        try:
+            # concurrent, rate-limited fetches; results land as they complete
+            for key, row in get_client().map(enricher.enrich_one, missing):
+                if row is None:
+                    metrics.ENRICHED.inc(kind=kind, source="not_found")
+                    continue
+                batch[key] = row
+                if len(batch) >= _CHECKPOINT_EVERY:
+                    store.put_many(kind, batch)
+                    have.update(batch)
+                    batch = {}
+        finally:
+            # keep whatever finished, even if a fetch blew up mid-run
+            store.put_many(kind, batch)
+            have.update(batch)
+    finally:
+        store.close()
+    return pd.DataFrame([have.get(k, blank) for k in keys])
 
-    if cache_ok:
-        df = pd.read_parquet(paths["df"])
-        X = np.load(paths["X"])
-        knn = joblib.load(paths["knn"])
-        return df, X, knn
 
-    # cache stale or missing ------------------------------------------------
-    _delete_cache(kind)
+def _prune_meta(kind: str, keys):
+    """Drop stored metadata for ids that are in none of the *kind* sections."""
+    store = MetaStore(_META_DB)
+    try:
+        store.prune(kind, list(keys))
+    finally:
+        store.close()
 
-    # enrich metadata (heavy part)
-    enricher = Movie() if kind == "movie" else TVShow()
-    meta_df = enricher.enrich_with_tmdb(lib_df)
 
+def _frame(lib_df: pd.DataFrame, meta_df: pd.DataFrame) -> pd.DataFrame:
+    """Join a section listing with its metadata into a shard data frame."""
     df = pd.concat([lib_df.reset_index(drop=True), meta_df.reset_index(drop=True)], axis=1)
-    X = Model().build_features(df)
-    knn = Model().train_index(X)
+    df["key"] = [meta_key(row) for _, row in lib_df.iterrows()]
+    df = df.drop_duplicates("key").reset_index(drop=True)
+    df["removed"] = False
+    return df
+
+
+def _fresh_drift(n_fit: int) -> dict:
+    return {"n_fit": n_fit, "n_added": 0, "seen": 0, "unseen": 0}
+
+
+def _update(kind: str, lib_df: pd.DataFrame, paths: dict, space: FeatureSpace):
+    """Patch one shard (cached at *paths*) to match its section listing
+    *lib_df* without refitting.
 
-    # write cache
-    df.to_parquet(paths["df"])
-    np.save(paths["X"], X)
-    joblib.dump(knn, paths["knn"])
-    paths["count"].write_text(str(cur_len))
-    return df, X, knn
+    New titles are transformed with the frozen `FeatureSpace` and appended;
+    titles that left the section are tombstoned (``removed`` column).
+    Returns `(df, X, knn, drift)`,
+    ``None`` when the shard should be rebuilt in the same space, and raises
+    `_Refit` when its new titles drift too far from the space.
+    """
+    df = pd.read_parquet(paths["df"])
+    if not {"key", "rating_key"} <= set(df.columns):
+        metrics.CACHE.inc(kind=kind, event="rebuild", reason="old_format")
+        return None
+    X = open_matrix(paths["X"])
+    drift = json.loads(paths["drift"].read_text())
+
+    lib_keys = [meta_key(row) for _, row in lib_df.iterrows()]
+    wanted = set(lib_keys)
+    df["removed"] = ~df["key"].isin(wanted)
+    # renamed / re-added items (modified in Plex) follow the library
+    for col in ("title", "rating_key", "section_id"):
+        current = dict(zip(lib_keys, lib_df[col]))
+        df[col] = df["key"].map(current).fillna(df[col]).astype(df[col].dtype)
+    cached = set(df["key"])
+    added = [k for k in dict.fromkeys(lib_keys) if k not in cached]
+
+    if added:
+        lib_df = lib_df.assign(key=lib_keys).drop_duplicates("key")
+        new = lib_df[lib_df["key"].isin(added)].reset_index(drop=True)
+        with metrics.stage("enrich"):
+            new = pd.concat([new, _enrich(kind, new)], axis=1)
+        total, unseen = space.label_counts(new)
+        drift = {**drift, "n_added": drift["n_added"] + len(new),
+                 "seen": drift["seen"] + total, "unseen": drift["unseen"] + unseen}
+        if drift["unseen"] > _DRIFT_MAX * drift["seen"] or drift["n_added"] > _APPEND_MAX * drift["n_fit"]:
+            reason = "drift" if drift["unseen"] > _DRIFT_MAX * drift["seen"] else "appended"
+            metrics.CACHE.inc(kind=kind, event="rebuild", reason=reason)
+            raise _Refit(reason)
+        new["removed"] = False
+        X = sp.vstack([X, space.transform(new)], format="csr")
+        df = pd.concat([df, new], ignore_index=True)
+
+    if df["removed"].mean() > _TOMBSTONE_MAX:
+        metrics.CACHE.inc(kind=kind, event="rebuild", reason="tombstones")
+        return None
+
+    # new rows join the existing index; IVF buckets them, no re-clustering
+    knn = load_index(paths["index"], X).extend(X)
+    metrics.CACHE.inc(kind=kind, event="update", reason=f"+{len(added)}" if added else "removed_only")
+    return df, X, knn, drift
+
+
+def _rebuild(kind: str, lib_df: pd.DataFrame, paths: dict, space: FeatureSpace, sig: str):
+    """Rebuild one shard from its listing in the kind's frozen feature space."""
+    with metrics.stage("enrich"):
+        df = _frame(lib_df, _enrich(kind, lib_df))
+    if space.unseen_ratio(df) > _DRIFT_MAX:      # e.g. a new section unlike the others
+        metrics.CACHE.inc(kind=kind, event="rebuild", reason="drift")
+        raise _Refit("drift")
+    with metrics.stage("build_features"):
+        X = space.transform(df)
+    with metrics.stage("train_index"):
+        knn = Model().train_index(X)
+    _write(paths, df, X, knn, _fresh_drift(len(df)), sig)
+
+
+def _refresh_shard(kind: str, section: dict, src: Path, dest: Path) -> str:
+    """Bring one section's shard from generation *src* up to date in *dest*
+    (runs in a worker process).
+
+    Returns what happened: 'unchanged', 'updated', 'rebuilt', or 'refit'
+    when the kind's feature space has to be refit first.
+    """
+    shard = _shard(kind, section)
+    old, paths = _paths(src, shard), _paths(dest, shard)
+    with metrics.stage("library_refresh"):
+        lib_df, delta, sig = library_watch.refresh(kind, section, src, dest)
+    have_cache = _has_cache(old)
+    if have_cache and not delta.full and not delta:
+        # section touched but nothing we index changed
+        paths["signature"].write_text(sig)
+        _link(src, dest, shard)
+        return "unchanged"
+    metrics.CACHE.inc(kind=kind, event="miss", reason="signature_changed" if have_cache else "no_cache")
+
+    space = joblib.load(_kind_paths(dest)["space"])
+    try:
+        if have_cache:
+            with metrics.stage("incremental_update"):
+                updated = _update(kind, lib_df, old, space)
+            if updated is not None:
+                _write(paths, *updated, sig)
+                return "updated"
+        _rebuild(kind, lib_df, paths, space, sig)
+        return "rebuilt"
+    except _Refit:
+        return "refit"
+
+
+def _list_shard(kind: str, section: dict, src: Path, dest: Path):
+    """Refresh one section's listing and its stored metadata (runs in a worker process)."""
+    with metrics.stage("library_refresh"):
+        lib_df, _, sig = library_watch.refresh(kind, section, src, dest)
+    with metrics.stage("enrich"):
+        meta = _enrich(kind, lib_df)
+    return lib_df, meta, sig
+
+
+def _index_shard(paths: dict, sig: str):
+    """Train the index of a freshly refit shard (runs in a worker process)."""
+    X = open_matrix(paths["X"])
+    with metrics.stage("train_index"):
+        knn = Model().train_index(X)
+    with metrics.stage("cache_write"):
+        knn.save(paths["index"])
+        paths["signature"].write_text(sig)
+
+
+def _refit(kind: str, sections: List[dict], src: Path, dest: Path):
+    """Fit the kind's feature space on every section and build all shards in it, into *dest*."""
+    listed = _parallel(_list_shard, [(kind, s, src, dest) for s in sections])
+    frames = {}
+    for section, (lib_df, meta, sig) in zip(sections, listed):
+        frames[_shard(kind, section)] = (_frame(lib_df, meta), sig)
+    everything = pd.concat([df for df, _ in frames.values()], ignore_index=True).drop_duplicates("key")
+    _prune_meta(kind, everything["key"])
+
+    with metrics.stage("build_features"):
+        space = FeatureSpace().fit(everything)
+        kind_paths = _kind_paths(dest)
+        joblib.dump(space, kind_paths["space"])
+        kind_paths["model"].write_text(uuid.uuid4().hex)   # profiles start over
+        for shard, (df, _) in frames.items():
+            paths = _paths(dest, shard)
+            df.to_parquet(paths["df"])
+            save_matrix(paths["X"], space.transform(df))
+            paths["drift"].write_text(json.dumps(_fresh_drift(len(df))))
+    _parallel(_index_shard, [(_paths(dest, shard), sig) for shard, (_, sig) in frames.items()])
+
+
+def _neighbors(kind: str, sections: List[dict], src: Optional[Path], dest: Path,
+               outcomes: Optional[Dict[str, str]]):
+    """Write the neighbour table of *dest*, over every shard (global row ids).
+
+    With the *outcomes* of a delta build (shard → `_refresh_shard` result,
+    missing = carried over) the table of *src* is renumbered to the new
+    layout: rows of unchanged and updated shards keep their lists, rows of
+    rebuilt, new or dropped sections come and go (`NeighborTable.remap`).
+    Otherwise it is built from scratch. Either way the shards' matrices are
+    stacked here, at build time – the view only ever maps them.
+    """
+    names = [_shard(kind, s) for s in sections]
+    parts = [open_matrix(_paths(dest, name)["X"]) for name in names]
+    offsets = dict(zip(names, np.cumsum([0] + [X.shape[0] for X in parts])))
+    X = sp.vstack(parts, format="csr")
+    removed = np.concatenate([pd.read_parquet(_paths(dest, name)["df"], columns=["removed"])["removed"].values
+                              for name in names])
+    old = _kind_paths(src)["neighbors"] if src else None
+    with metrics.stage("neighbors"):
+        if outcomes is None or old is None or not old.exists():
+            table = NeighborTable.build(X, exclude=removed)
+        else:
+            table = load_table(old)
+            mapping, start = np.full(len(table), -1, dtype=np.intp), 0
+            for name in _shards_in(src, kind):
+                size = open_matrix(_paths(src, name)["X"]).shape[0]
+                if name in offsets and outcomes.get(name, "unchanged") in {"unchanged", "updated"}:
+                    mapping[start:start + size] = offsets[name] + np.arange(size)
+                start += size
+            if start == len(table):
+                table = table.remap(X, mapping, exclude=removed)
+            else:
+                table = NeighborTable.build(X, exclude=removed)
+    with metrics.stage("cache_write"):
+        table.save(_kind_paths(dest)["neighbors"])
+
+
+def _worker_init(workers: int, tmdb: dict, plex: dict):
+    """Worker process setup: the parent's TMDB / Plex settings (a spawned
+    worker starts from a fresh interpreter) and a share of the TMDB rate limit."""
+    tmdb_client._client = tmdb_client.TMDBClient(tmdb["api_key"], base_url=tmdb["base_url"],
+                                                 rate=tmdb["rate"] / workers, workers=tmdb["workers"])
+    plex_context._context = plex_context.PlexContext(plex["base_url"], plex["token"])
+
+
+def _parallel(fn, jobs: List[tuple]) -> list:
+    """Return `[fn(*job) for job in jobs]`, run in SHARD_WORKERS processes when
+    there is more than one job.
+
+    Workers are spawned, not forked: builds run on a background thread while
+    the service's other threads may hold locks a forked child would inherit.
+    They keep their own metrics; only the parent's stage timings around the
+    whole run are recorded.
+    """
+    workers = min(len(jobs), SHARD_WORKERS or os.cpu_count() or 1)
+    if workers <= 1:
+        return [fn(*job) for job in jobs]
+    client, ctx = get_client(), context()
+    tmdb = {"api_key": client.api_key, "base_url": client.base_url,
+            "rate": client.bucket.rate, "workers": client.workers}
+    plex = {"base_url": ctx.base_url, "token": ctx.token}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_worker_init, initargs=(workers, tmdb, plex)) as pool:
+        return list(pool.map(fn, *zip(*jobs)))
+
+
+def _stale(kind: str, gen: Optional[Path], sections: List[dict]) -> List[dict]:
+    """Sections whose shard in *gen* is missing or behind their signature
+    (all of them when *gen* predates the kind-wide neighbour table)."""
+    if gen and not _kind_paths(gen)["neighbors"].exists():
+        return sections
+    stale = []
+    for section in sections:
+        paths = _paths(gen, _shard(kind, section)) if gen else None
+        if not (paths and _has_cache(paths) and paths["signature"].exists()
+                and paths["signature"].read_text() == library_watch.signature(section)):
+            stale.append(section)
+    return stale
+
+
+def _digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _manifest(gen: Path) -> dict:
+    try:
+        return json.loads((gen / "manifest.json").read_text())["files"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return {}
+
+
+def _seal(gen: Path, src: Optional[Path]):
+    """Write *gen*'s manifest: size and SHA-256 of every file. Files hard-linked
+    from generation *src* keep its entries instead of being hashed again."""
+    known = _manifest(src) if src else {}
+    files = {}
+    for p in sorted(gen.iterdir()):
+        if not p.is_file():
+            continue
+        linked = p.name in known and (src / p.name).exists() and os.path.samefile(p, src / p.name)
+        files[p.name] = known[p.name] if linked else [p.stat().st_size, _digest(p)]
+    (gen / "manifest.json").write_text(json.dumps({"files": files}))
+
+
+def _verify(gen: Path, checksum: bool = False):
+    """Raise `_Corrupt` unless every file in *gen*'s manifest is there at full
+    size (and, with *checksum*, hashes the same) and *gen* was never marked
+    damaged."""
+    files = _manifest(gen)
+    if not files:
+        raise _Corrupt(f"{gen.name} has no manifest")
+    if (gen / "CORRUPT").exists():
+        raise _Corrupt(f"{gen.name} was found damaged before")
+    for name, (size, digest) in files.items():
+        p = gen / name
+        if not p.exists() or p.stat().st_size != size or (checksum and _digest(p) != digest):
+            raise _Corrupt(f"{gen.name}/{name} is missing or damaged")
+
+
+def _last_good(kind: str) -> Optional[Path]:
+    """Return the current generation if intact, else the newest intact one
+    (and make it current); ``None`` when there is none."""
+    current = _current(kind)
+    gens = sorted((p for p in (_CACHE / kind).glob("gen-*") if not p.name.endswith(".tmp")),
+                  key=lambda p: p.stat().st_mtime, reverse=True)
+    for gen in ([current] if current else []) + [g for g in gens if g != current]:
+        try:
+            _verify(gen)
+        except _Corrupt as exc:
+            log.warning("Skipping %s cache: %s", kind, exc)
+            metrics.CACHE.inc(kind=kind, event="corrupt", reason="manifest")
+            continue
+        if gen != current:
+            _point(kind, gen)
+        return gen
+    return None
+
+
+def _publish(kind: str, force: bool = False, timeout: Optional[float] = None) -> Path:
+    """Build the next *kind* generation and make it current; return it.
+
+    Single-flight across processes: the build runs under a file lock per
+    kind, and whoever gets it second re-checks the library and usually
+    finds nothing left to do. Raises `TimeoutError` if another process held
+    the lock for more than *timeout* seconds.
+
+    The generation is written to a temporary directory – unchanged shards
+    are hard-linked from the last good one, stale ones brought up to date
+    with a delta in parallel worker processes (`_refresh_shard`) – sealed
+    with a manifest and renamed into place before the `current` pointer is
+    switched, so readers only ever see a complete generation. The space is
+    refit on every section only when forced, missing or when a shard
+    drifted too far.
+    """
+    with file_lock(_CACHE / kind / "build.lock", timeout) as held:
+        if not held:
+            metrics.CACHE.inc(kind=kind, event="lock_timeout", reason="build")
+            raise TimeoutError(f"Another process is still building the {kind} cache")
+        for leftover in (_CACHE / kind).glob("gen-*.tmp"):     # from a build that crashed
+            shutil.rmtree(leftover, ignore_errors=True)
+
+        src = _last_good(kind)
+        with metrics.stage("cache_check"):
+            sections = library_watch.sections(kind)
+            stale = sections if force else _stale(kind, src, sections)
+        if src is not None and not stale and _shards_in(src, kind) == [_shard(kind, s) for s in sections]:
+            return src                             # someone else just published it
+
+        gen = _CACHE / kind / f"gen-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        tmp = gen.with_name(gen.name + ".tmp")
+        tmp.mkdir(parents=True)
+        try:
+            refit = force or src is None
+            if not refit:
+                for name in ("space", "model"):
+                    os.link(_kind_paths(src)[name], _kind_paths(tmp)[name])
+                for section in sections:
+                    if section not in stale:
+                        _link(src, tmp, _shard(kind, section))
+                with metrics.stage("shard_refresh"):
+                    outcomes = _parallel(_refresh_shard, [(kind, s, src, tmp) for s in stale])
+                for outcome in outcomes:
+                    metrics.CACHE.inc(kind=kind, event="shard", reason=outcome)
+                refit = "refit" in outcomes
+                outcomes = dict(zip([_shard(kind, s) for s in stale], outcomes))
+                if not refit and set(outcomes.values()) - {"unchanged"}:
+                    live = [pd.read_parquet(_paths(tmp, _shard(kind, s))["df"], columns=["key", "removed"])
+                            for s in sections]
+                    _prune_meta(kind, pd.concat(live).query("~removed")["key"])
+            if refit:
+                metrics.CACHE.inc(kind=kind, event="miss",
+                                  reason="forced" if force else "no_cache" if src is None else "refit")
+                shutil.rmtree(tmp)                 # linked files must never be written to
+                tmp.mkdir()
+                with metrics.stage("refit"):
+                    _refit(kind, sections, src or tmp, tmp)
+            _neighbors(kind, sections, src, tmp, None if refit else outcomes)
+            _seal(tmp, None if refit else src)
+            os.rename(tmp, gen)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        _point(kind, gen)
+        metrics.CACHE.inc(kind=kind, event="publish", reason="refit" if refit else "delta")
+        _prune_generations(kind)
+        return gen
+
+
+def refresh(kind: str, reason: str = "requested"):
+    """Rebuild *kind* on a background thread; queries keep using the current
+    generation meanwhile. A request while one runs queues one more pass.
+
+    With DETACH_REFRESH the rebuild runs in a process of its own instead
+    (`_detach`), so it survives the one-shot process that asked for it.
+    """
+    if DETACH_REFRESH:
+        metrics.CACHE.inc(kind=kind, event="refresh", reason=reason)
+        _detach(kind, reason)
+        return
+    with _REFRESH_LOCK:
+        if kind in _REFRESHING:
+            _AGAIN.add(kind)
+            return
+        thread = threading.Thread(target=_refresh_loop, args=(kind,), name=f"refresh-{kind}")
+        _REFRESHING[kind] = thread
+    metrics.CACHE.inc(kind=kind, event="refresh", reason=reason)
+    thread.start()
+
+
+def _detach(kind: str, reason: str):
+    """Start `refresh(kind)` in a new session with no ties to this process
+    (its output would go to a pipe Tautulli closes). It logs to the webhook
+    log, and the build lock makes it a no-op if another build got there first."""
+    with _REFRESH_LOCK:
+        if kind in _DETACHED:          # once per process is enough
+            return
+        _DETACHED.add(kind)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [here, os.getenv("PYTHONPATH")]))}
+    code = f"import tautulli_webhook, rec_engine; rec_engine.refresh({kind!r}, {reason!r})"
+    detached = ({"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+                if os.name == "nt" else {"start_new_session": True})
+    subprocess.Popen([sys.executable, "-c", code], cwd=os.getcwd(), env=env, stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, **detached)
+
+
+def _refresh_loop(kind: str):
+    while True:
+        try:
+            _publish(kind)
+        except Exception:
+            log.exception("Background %s rebuild failed", kind)
+        with _REFRESH_LOCK:
+            if kind not in _AGAIN:
+                del _REFRESHING[kind]
+                return
+            _AGAIN.discard(kind)
+
+
+def _serve(kind: str, *, force: bool = False, wait: bool = False):
+    """Return `(generation, (df, X, knn, table), titles)` for *kind*, where
+    *titles* is the generation's `Model.title_index`.
+
+    One light Plex request checks the section signatures. A stale cache is
+    rebuilt in the background (`refresh`) while this call answers from the
+    current generation; only *force*, *wait* or a missing cache build in the
+    foreground – waiting at most CACHE_LOCK_TIMEOUT for a build another
+    process is running, then answering from the last good generation.
+    """
+    if not force and kind in _PINNED:
+        return _PINNED[kind]
+    gen = _current(kind)
+    build = force or gen is None or not _kind_paths(gen)["neighbors"].exists()   # older layout
+    if not build:
+        with metrics.stage("cache_check"):
+            sections = library_watch.sections(kind)
+            stale = (_stale(kind, gen, sections)
+                     or _shards_in(gen, kind) != [_shard(kind, s) for s in sections])
+        build = stale and wait
+        if stale and not wait:
+            refresh(kind, reason="stale")
+    if build:
+        try:
+            gen = _publish(kind, force=force, timeout=CACHE_LOCK_TIMEOUT)
+        except TimeoutError:
+            gen = _last_good(kind)
+            if gen is None:
+                raise
+            log.warning("%s cache build still running elsewhere – serving %s", kind, gen.name)
+    try:
+        return (gen, *_view(kind, gen))
+    except _Corrupt as exc:
+        # torn or damaged on disk: mark it so no one picks it again (a
+        # checksum mismatch passes the size check `_last_good` makes) and
+        # fall back to the newest intact generation
+        log.error("%s cache unusable: %s", kind, exc)
+        metrics.CACHE.inc(kind=kind, event="corrupt", reason="load")
+        (gen / "CORRUPT").write_text(str(exc))
+        try:
+            gen = _publish(kind, timeout=CACHE_LOCK_TIMEOUT)
+        except TimeoutError:
+            gen = _last_good(kind)
+            if gen is None:
+                raise
+            log.warning("%s cache build still running elsewhere – serving %s", kind, gen.name)
+        return (gen, *_view(kind, gen))
+
+
+def _build(kind: str, *, force: bool = False, wait: bool = False) -> Tuple[pd.DataFrame, sp.csr_matrix, object, NeighborTable]:
+    """Return `(df, X, knn, table)` for *kind* ('movie' | 'tv'), over every section (see `_serve`)."""
+    return _serve(kind, force=force, wait=wait)[1]
+
+
+def _view(kind: str, gen: Path):
+    """The merged `(df, X, knn, table)` of generation *gen* and its title index,
+    memoised per generation."""
+    if kind in _LOADED and _LOADED[kind][0] == gen:
+        metrics.CACHE.inc(kind=kind, event="hit", reason="memory")
+        return _LOADED[kind][1:]
+    metrics.CACHE.inc(kind=kind, event="hit", reason="disk")
+    # columns are read on demand and X is memory-mapped, so a cold
+    # start costs about the same whatever the library size
+    with metrics.stage("cache_load"):
+        _verify(gen, checksum=CACHE_VERIFY == "checksum")
+        view = shards.stack([_load(_paths(gen, name)) for name in _shards_in(gen, kind)],
+                            load_table(_kind_paths(gen)["neighbors"]))
+        titles = Model().title_index(view[0])
+    _LOADED[kind] = (gen, view, titles)
+    return view, titles
+
+
+def _load(paths: dict):
+    df = pd.read_parquet(paths["df"], columns=_SERVE_COLUMNS, memory_map=True)
+    X = open_matrix(paths["X"])
+    return df, X, load_index(paths["index"], X)
+
+
+def _write(paths: dict, df: pd.DataFrame, X: sp.csr_matrix, knn, drift: dict, signature: str):
+    with metrics.stage("cache_write"):
+        df.to_parquet(paths["df"])
+        save_matrix(paths["X"], X)
+        knn.save(paths["index"])
+        paths["drift"].write_text(json.dumps(drift))
+        paths["signature"].write_text(signature)
+
+
+@contextmanager
+def pinned(*kinds: str):
+    """Bring each *kind* up to date once (in the foreground), then answer every
+    query inside the block from that snapshot – no per-query library scan,
+    no rebuilds.
+
+    Meant for batch runs (`main.rec_all`) that query many users back to back.
+    Kinds the server has no library section for are skipped; the block gets
+    the list of kinds actually pinned.
+    """
+    for kind in kinds:
+        try:
+            _PINNED[kind] = _serve(kind, wait=True)
+        except LookupError as exc:
+            log.warning("Skipping %s: %s", kind, exc)
+    try:
+        yield [kind for kind in kinds if kind in _PINNED]
+    finally:
+        for kind in kinds:
+            _PINNED.pop(kind, None)
+
+
+def warm(kind: str):
+    """Load the *kind* cache into this process ahead of the first query
+    (building it if there is none; a stale one is refreshed in the background)."""
+    _build(kind)
+
+
+def feature_space(kind: str):
+    """Return the frozen `FeatureSpace` of the *kind* library (building it if needed)."""
+    gen, *_ = _serve(kind)
+    return joblib.load(_kind_paths(gen)["space"])
+
+
+def _catalog_recs(kind: str, gen: Path, df: pd.DataFrame, rows: List[int],
+                  per_seed: int, top_n: int) -> pd.DataFrame:
+    catalog = Catalog(kind)
+    if not catalog.exists():
+        return pd.DataFrame(columns=["title", "score", "seed"])
+    # seeds are re-projected into the space the catalog was built with, which
+    # needs their full metadata rows – not just the serve columns
+    full = pd.concat([pd.read_parquet(_paths(gen, name)["df"]) for name in _shards_in(gen, kind)],
+                     ignore_index=True)
+    Q = catalog.space().transform(full.iloc[rows])
+    in_library = df.loc[~df["removed"], "key"]
+    recs = catalog.recommend(Q, df["title"].values[rows].tolist(), in_library,
+                             n=per_seed, top_n=top_n)
+    return recs.drop(columns="key")
 
 
 def recommend_from_seeds(
@@ -79,36 +783,159 @@ def recommend_from_seeds(
     top_n: int = 25,
     *,
     force: bool = False,
+    source: str = "library",
 ) -> pd.DataFrame:
     """Return a deduplicated recommendation list.
 
-    • If *force* is True the cache is ignored and rebuilt.
+    • If *force* is True the cache is rebuilt before answering.
+    • Seeds missing from the library (maybe freshly added) are skipped and a
+      background refresh is queued – the call never waits for a rebuild.
+    • *source* picks the candidates: 'library' (on the server), 'catalog'
+      (ingested TMDB titles not on the server) or 'both'.
     """
-    df, X, knn = _build(kind, force=force)
+    if source not in {"library", "catalog", "both"}:
+        raise ValueError("source must be 'library', 'catalog' or 'both'")
+    gen, (df, X, knn, table), index = _serve(kind, force=force)
 
-    rec_frames = []
-    for title in seeds:
-        try:
-            recs = Model().recommend(title, df, X, knn).head(per_seed)
-            recs["seed"] = title
-            rec_frames.append(recs)
-        except ValueError:
-            # Title not in library (maybe freshly added) – trigger rebuild once
-            if not force:
-                return recommend_from_seeds(seeds, kind, per_seed, top_n, force=True)
-            continue
+    model = Model()
+    rows = [index[t] for t in dict.fromkeys(seeds) if t in index]
+    metrics.SEEDS.inc(len(rows), kind=kind, result="resolved")
+    metrics.SEEDS.inc(len(set(seeds)) - len(rows), kind=kind, result="unresolved")
+    if len(rows) < len(set(seeds)) and not force and kind not in _PINNED:
+        refresh(kind, reason="missing_seeds")
 
-    if not rec_frames:
+    if not rows:
         return pd.DataFrame()
 
-    out = (
-        pd.concat(rec_frames)
+    frames = []
+    if source in {"library", "both"}:
+        with metrics.stage("knn"):
+            frames.append(model.recommend_many(rows, df, X, knn, n=per_seed, top_n=top_n, table=table)
+                          .assign(source="library"))
+    if source in {"catalog", "both"}:
+        with metrics.stage("catalog_knn"):
+            frames.append(_catalog_recs(kind, gen, df, rows, per_seed, top_n).assign(source="catalog"))
+    if len(frames) == 1:
+        return frames[0]
+    return (
+        pd.concat(frames, ignore_index=True)
+        .sort_values("score", ascending=False, kind="stable")
         .drop_duplicates("title", keep="first")
-        .sort_values("score", ascending=False)
         .head(top_n)
         .reset_index(drop=True)
     )
+
+def _epoch(watched_at):
+    return None if watched_at is None or pd.isna(watched_at) else pd.Timestamp(watched_at).timestamp()
+
+
+def _profile(store: ProfileStore, username: str, kind: str, watched: pd.DataFrame,
+             df: pd.DataFrame, X: sp.csr_matrix, index: dict, model_id: str) -> Profile:
+    """Load *username*'s profile, fold in watches newer than it and save it."""
+    profile = store.get(username, kind)
+    if profile is None or profile.model != model_id or profile.vector.size != X.shape[1]:
+        profile = Profile(model_id, X.shape[1])
+    keys = df["key"].values
+    events = [(t, _epoch(at)) for t, at in zip(watched["title"], watched["watched_at"])]
+    changed = False
+    for title, ts in sorted(events, key=lambda e: e[1] or time.time()):
+        row = index.get(title)
+        if row is None:
+            continue
+        seen_at = profile.watched.get(keys[row])
+        if seen_at is not None and (ts is None or ts <= seen_at):
+            continue
+        profile.add(keys[row], X[row].toarray().ravel(), ts or time.time())
+        changed = True
+    if changed:
+        store.put(username, kind, profile)
+    return profile
+
+
+def _profile_recs(df: pd.DataFrame, X: sp.csr_matrix, watched_rows: np.ndarray,
+                  ids: np.ndarray, scores: np.ndarray) -> pd.DataFrame:
+    """Frame one user's hits, crediting each to the watched title closest to it."""
+    hit = ids >= 0
+    ids, scores = ids[hit], scores[hit]
+    titles = df["title"].values
+    seed = None
+    if watched_rows.size:
+        seed = titles[watched_rows[np.asarray((X[watched_rows] @ X[ids].T).todense()).argmax(axis=0)]]
+    recs = pd.DataFrame({"title": titles[ids], "score": scores, "seed": seed})
+    if "rating_key" in df.columns:
+        recs["rating_key"] = df["rating_key"].values[ids]
+    return recs.drop_duplicates("title").reset_index(drop=True)    # same title in two sections
+
+
+def recommend_for_user(username: str, watched: pd.DataFrame, kind: str, top_n: int = 25) -> pd.DataFrame:
+    """Return *username*'s recommendations from their taste profile.
+
+    • *watched* is `get_recently_watched` output (title, watched_at); watches
+      newer than the stored profile are folded in and the profile saved.
+    • The profile starts over when the model has been refit from scratch.
+    • One index query per call; titles the user watched are never returned.
+    """
+    gen, (df, X, knn, _), index = _serve(kind)
+    model_id = _kind_paths(gen)["model"].read_text()
+
+    with metrics.stage("profile_update"):
+        store = ProfileStore()
+        try:
+            profile = _profile(store, username, kind, watched, df, X, index, model_id)
+        finally:
+            store.close()
+
+    norm = np.linalg.norm(profile.vector)
+    if not norm:
+        return pd.DataFrame()
+    seen = df["key"].isin(list(profile.watched)).values
+    with metrics.stage("knn"):
+        ids, scores = knn.search(sp.csr_matrix(profile.vector / norm), top_n,
+                                 exclude=df["removed"].values | seen)
+    return _profile_recs(df, X, np.flatnonzero(seen), ids[0], scores[0])
+
+
+def recommend_for_users(watched: Dict[str, pd.DataFrame], kind: str,
+                        top_n: int = 25) -> Dict[str, pd.DataFrame]:
+    """`recommend_for_user` for every user in *watched* (username → history) at once.
+
+    All profiles are stacked into one matrix and scored against the whole
+    library in blocked matrix products (`shards.search_many`); each
+    user's watched titles are masked out before a partial sort picks their
+    *top_n*. Exact whatever the index backend.
+    """
+    gen, (df, X, _, _), index = _serve(kind)
+    model_id = _kind_paths(gen)["model"].read_text()
+
+    with metrics.stage("profile_update"):
+        store = ProfileStore()
+        try:
+            profiles = {user: _profile(store, user, kind, history, df, X, index, model_id)
+                        for user, history in watched.items()}
+        finally:
+            store.close()
+
+    users = [u for u, p in profiles.items() if np.linalg.norm(p.vector)]
+    out = {u: pd.DataFrame() for u in profiles if u not in users}
+    if not users:
+        return out
+    Q = np.vstack([profiles[u].vector / np.linalg.norm(profiles[u].vector) for u in users])
+
+    # one sparse row of watched-title positions per user (a title can be in several sections)
+    rows_of = df.groupby("key", sort=False).indices
+    seen = [[r for k in profiles[u].watched if k in rows_of for r in rows_of[k]] for u in users]
+    masks = sp.csr_matrix(
+        (np.ones(sum(map(len, seen)), dtype=bool),
+         np.concatenate([np.asarray(r, dtype=np.intp) for r in seen]),
+         np.concatenate([[0], np.cumsum([len(r) for r in seen])])),
+        shape=(len(users), len(df)),
+    )
+    with metrics.stage("batch_score"):
+        ids, scores = shards.search_many(X, Q, top_n, exclude=df["removed"].values, masks=masks)
+    for i, user in enumerate(users):
+        out[user] = _profile_recs(df, X, np.asarray(seen[i], dtype=np.intp), ids[i], scores[i])
     return out
 
+
 if __name__ == "__main__":
     print(recommend_from_seeds(["Inception", "Anchorman: The Legend of Ron Burgundy"], "movie"))
\ No newline at end of file
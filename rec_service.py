@@ -0,0 +1,136 @@
+# rec_service.py
+# Resident recommendation service. Keeps pandas/scikit-learn imported, the
+# model + index loaded and the Plex connections open, and takes work over a
+# local HTTP endpoint so each Tautulli event only pays for its own query.
+#
+#   POST /event       Tautulli payload (see webhook_client.py) → 202, queued
+#                     and debounced per (user, kind) – see job_queue.py
+#   POST /recommend   {"seeds": [...], "kind": "movie", "top_n": 25} → recs
+#                     add "profile": true to capture a cProfile of the call
+#   GET  /health      liveness + queue depth
+#   GET  /metrics     Prometheus text: stage timings, HTTP calls, cache hits… (metrics.py)
+#
+# Run it with `python rec_service.py` and set RECS_SERVICE_URL for webhook.sh.
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import metrics
+import tautulli_webhook                  # configures logging to the webhook log
+from job_queue import JobQueue
+from rec_engine import recommend_from_seeds, warm
+from webhook_client import RECS_SERVICE_URL
+
+log = logging.getLogger(__name__)
+
+_jobs = None     # JobQueue, created by serve()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply_text(self, status: int, text: str, content_type: str = "text/plain; version=0.0.4"):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._reply(200, {"status": "ok", "queued": _jobs.depth(), **_jobs.stats})
+        elif path == "/metrics":
+            self._reply_text(200, metrics.prometheus(_queue_gauges()))
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        try:
+            body = self._body()
+        except ValueError as exc:
+            self._reply(400, {"error": f"bad JSON: {exc}"})
+            return
+
+        if path == "/event":
+            try:
+                key = tautulli_webhook.event_key(body)
+            except KeyError as exc:
+                self._reply(400, {"error": f"missing field {exc}"})
+                return
+            if key is None:
+                self._reply(200, {"queued": False, "ignored": body.get("event")})
+                return
+            covered = _jobs.submit(key, body)
+            self._reply(202, {"queued": True, "coalesced": covered - 1})
+        elif path == "/recommend":
+            kind = body.get("kind", "movie")
+            if kind not in {"movie", "tv"} or not isinstance(body.get("seeds"), list):
+                self._reply(400, {"error": "need 'seeds' (list) and kind 'movie' | 'tv'"})
+                return
+            try:
+                top_n = int(body.get("top_n", 25))
+            except (TypeError, ValueError):
+                self._reply(400, {"error": "'top_n' must be an integer"})
+                return
+            try:
+                with metrics.profiled("recommend", enabled=bool(body.get("profile"))) as prof:
+                    recs = recommend_from_seeds(body["seeds"], kind, top_n=top_n)
+            except Exception as exc:
+                log.exception("Recommendation for %s failed", kind)
+                self._reply(500, {"error": str(exc)})
+                return
+            reply = {"recommendations": recs.to_dict("records")}
+            if prof:
+                reply["profile"] = str(prof)
+            self._reply(200, reply)
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def log_message(self, fmt, *args):
+        log.debug("%s - %s", self.address_string(), fmt % args)
+
+
+def _queue_gauges() -> str:
+    lines = ["# TYPE plexrec_queue_depth gauge", f"plexrec_queue_depth {_jobs.depth()}"]
+    for name, value in _jobs.stats.items():
+        if isinstance(value, (int, float)):
+            lines += [f"# TYPE plexrec_queue_{name}_total counter", f"plexrec_queue_{name}_total {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def serve(url: str = RECS_SERVICE_URL):
+    """Warm both caches, start the job queue and serve until interrupted."""
+    global _jobs
+    for kind in ("movie", "tv"):
+        try:
+            warm(kind)
+        except Exception as exc:
+            log.warning("Could not warm %s cache: %s", kind, exc)
+
+    _jobs = JobQueue(tautulli_webhook.process)
+
+    parsed = urlparse(url)
+    server = ThreadingHTTPServer((parsed.hostname or "127.0.0.1", parsed.port or 8765), _Handler)
+    log.info("Recommendation service listening on %s", url)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
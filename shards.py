@@ -0,0 +1,102 @@
+# shards.py
+# Stitches the per-section shards of a kind (one cache per Plex library
+# section, see rec_engine) into one view, so the query code keeps working
+# on a single `(df, X, index, table)`.
+#
+# Shards share the kind's frozen feature space, so scores from different
+# shards are directly comparable: a query is answered by every shard and
+# the per-shard top-k lists are merged. Row ids in the view are global –
+# shard s owns rows [offsets[s], offsets[s + 1]). The shards' matrices stay
+# memory-mapped as they are (`ShardedMatrix` gathers the rows asked for),
+# and the neighbour table is the kind's own, over global ids.
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import neighbor_table
+from neighbor_table import NeighborTable
+from vector_index import _pad
+
+
+def _merge(ids: List[np.ndarray], scores: List[np.ndarray], k: int):
+    """Row-wise top-*k* of several `(ids, scores)` result blocks."""
+    ids, scores = np.hstack(ids), np.hstack(scores)
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    ids = np.take_along_axis(ids, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    ids[~np.isfinite(scores)] = -1
+    return _pad(ids, scores, k)
+
+
+class ShardedIndex:
+    """`search` over every shard's index, with global row ids."""
+
+    backend = "sharded"
+
+    def __init__(self, indexes: list, offsets: np.ndarray):
+        self.indexes = indexes
+        self.offsets = offsets
+
+    def _slice(self, mask: Optional[np.ndarray], s: int):
+        return None if mask is None else mask[self.offsets[s]:self.offsets[s + 1]]
+
+    def search(self, Q, k: int, exclude: Optional[np.ndarray] = None):
+        """Top-*k* over all shards, like `index.search`."""
+        ids, scores = [], []
+        for s, index in enumerate(self.indexes):
+            part, best = index.search(Q, k, exclude=self._slice(exclude, s))
+            ids.append(np.where(part >= 0, part + self.offsets[s], -1))
+            scores.append(best)
+        return _merge(ids, scores, k)
+
+
+def search_many(X, Q, k: int, exclude: Optional[np.ndarray] = None,
+                masks: Optional[sp.csr_matrix] = None):
+    """`neighbor_table.search_many` over a plain or `ShardedMatrix` *X*."""
+    if not isinstance(X, ShardedMatrix):
+        return neighbor_table.search_many(X, Q, k, exclude=exclude, masks=masks)
+    ids, scores = [], []
+    for s, part in enumerate(X.parts):
+        lo, hi = X.offsets[s], X.offsets[s + 1]
+        top, best = neighbor_table.search_many(part, Q, k, exclude=None if exclude is None else exclude[lo:hi],
+                                               masks=None if masks is None else masks[:, lo:hi])
+        ids.append(np.where(top >= 0, top + lo, -1))
+        scores.append(best)
+    return _merge(ids, scores, k)
+
+
+class ShardedMatrix:
+    """Row access to the shards' item matrices as one, without stacking them.
+
+    Supports what the query path needs: ``shape`` and ``X[rows]`` (an int or
+    an array of global rows), which returns a csr matrix of those rows.
+    """
+
+    def __init__(self, parts: List[sp.csr_matrix]):
+        self.parts = parts
+        self.offsets = np.cumsum([0] + [p.shape[0] for p in parts])
+        self.shape = (int(self.offsets[-1]), parts[0].shape[1])
+        self.dtype = parts[0].dtype
+
+    def __getitem__(self, rows) -> sp.csr_matrix:
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.intp))
+        rows = np.where(rows < 0, rows + self.shape[0], rows)
+        owner = np.searchsorted(self.offsets, rows, side="right") - 1
+        order = np.argsort(owner, kind="stable")
+        blocks = [self.parts[s][rows[owner == s] - self.offsets[s]] for s in np.unique(owner)]
+        if not blocks:
+            return sp.csr_matrix((0, self.shape[1]), dtype=self.dtype)
+        out = sp.vstack(blocks, format="csr")
+        return out[np.argsort(order)]
+
+
+def stack(parts: list, table: NeighborTable):
+    """Return one `(df, X, index, table)` view over per-shard `(df, X, index)`
+    tuples *parts* and the kind's neighbour *table*."""
+    if len(parts) == 1:
+        return (*parts[0], table)
+    df = pd.concat([p[0] for p in parts], ignore_index=True)
+    X = ShardedMatrix([p[1] for p in parts])
+    return df, X, ShardedIndex([p[2] for p in parts], X.offsets), table
@@ -1,89 +1,222 @@
 import pandas as pd
 import requests
+import sqlite3
+import time
 from datetime import datetime
+from pathlib import Path
 from dotenv import load_dotenv
 import os
+import metrics
 
 load_dotenv(override=True)
 
 TAUTULLI_BASE_URL = os.getenv("TAUTULLI_BASE_URL")
 TAUTULLI_TOKEN = os.getenv("TAUTULLI_TOKEN")
+TAUTULLI_USERS_TTL = float(os.getenv("TAUTULLI_USERS_TTL", "3600"))   # seconds
+
+_HISTORY_DB = Path("plex_rec_cache") / "history.sqlite"
+_DELTA_PAGE = 25          # rows per incremental request – usually the only one
+_FULL_PAGE = 1000         # rows per request while mirroring a user the first time
+
+# one pooled keep-alive connection for every Tautulli call in this process
+_session = metrics.instrument(requests.Session())
 
 def get_tautulli_data(cmd, **params):
     """Helper to call the Tautulli API and return the JSON payload."""
     params["apikey"] = TAUTULLI_TOKEN
     url = f"{TAUTULLI_BASE_URL}/api/v2?cmd={cmd}"
-    resp = requests.get(url, params=params)
+    resp = _session.get(url, params=params, timeout=30)
     resp.raise_for_status()
     return resp.json()
 
 
+def _unwrap(resp):
+    """Return the list of rows inside a Tautulli v2 response."""
+    data = resp.get("response", {}).get("data", resp)
+    # Unwrap v2 history payload: data may be dict with 'data' list, or list directly
+    if isinstance(data, dict) and "data" in data:
+        return data["data"]
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        return [data]
+    return []
+
+
+def _entry_title(entry, media_type):
+    if (media_type == "movie"):
+        return entry.get("title") or entry.get("full_title")
+    return entry.get("grandparent_title")
+
+
+def _entry_time(entry):
+    ts = entry.get("date") or entry.get("timestamp") or entry.get("watched_at")
+    try:
+        return int(ts)
+    except Exception:
+        return None
+
+
+class HistoryMirror:
+    """Local SQLite copy of Tautulli watch history.
+
+    • `sync` pulls only rows newer than the newest stored one (one small
+      request in steady state; the full history only on first sight of a user).
+    • `user_id` caches the username → user_id map for TAUTULLI_USERS_TTL.
+    • `recent` answers "last N distinct titles" from an index.
+    """
+
+    def __init__(self, path=_HISTORY_DB):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                username   TEXT PRIMARY KEY,
+                user_id    INTEGER,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS history (
+                row_id     INTEGER PRIMARY KEY,
+                user_id    INTEGER NOT NULL,
+                media_type TEXT NOT NULL,
+                title      TEXT,
+                watched_at INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS history_recent
+                ON history (user_id, media_type, watched_at DESC);
+            CREATE TABLE IF NOT EXISTS synced (
+                user_id    INTEGER NOT NULL,
+                media_type TEXT NOT NULL,
+                PRIMARY KEY (user_id, media_type)
+            );
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def user_id(self, username):
+        """Resolve *username* via the cached user map, refreshing it past its TTL."""
+        row = self.conn.execute(
+            "SELECT user_id FROM users WHERE username = ? AND fetched_at >= ?",
+            (username, time.time() - TAUTULLI_USERS_TTL),
+        ).fetchone()
+        if row:
+            return row[0]
+
+        users = _unwrap(get_tautulli_data("get_users"))
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO users (username, user_id, fetched_at) VALUES (?, ?, ?)",
+            [(u.get("username"), u.get("user_id"), now) for u in users if u.get("username")],
+        )
+        self.conn.commit()
+        user = next((u for u in users if u.get("username") == username), users[0])
+        return user.get("user_id")
+
+    def sync(self, user_id, media_type):
+        """Pull new history rows for *user_id*; return rows Tautulli has not
+        assigned an id yet (still in progress) so callers can use them too."""
+        newest = self.conn.execute(
+            "SELECT MAX(watched_at) FROM history WHERE user_id = ? AND media_type = ?",
+            (user_id, media_type),
+        ).fetchone()[0]
+        first_sync = self.conn.execute(
+            "SELECT 1 FROM synced WHERE user_id = ? AND media_type = ?", (user_id, media_type)
+        ).fetchone() is None
+        length = _FULL_PAGE if first_sync else _DELTA_PAGE
+
+        live, start = [], 0
+        while True:
+            page = _unwrap(get_tautulli_data(
+                "get_history",
+                user_id=user_id,
+                media_type=media_type,
+                order_column="date",
+                order_dir="desc",
+                start=start,
+                length=length,
+            ))
+            rows = []
+            for entry in page:
+                record = (_entry_title(entry, media_type), _entry_time(entry))
+                if entry.get("id") is None:
+                    live.append(record)
+                else:
+                    rows.append((entry["id"], user_id, media_type, *record))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO history (row_id, user_id, media_type, title, watched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            # pages are newest-first: stop once we reach what we already had
+            caught_up = newest is not None and any(
+                r[4] is not None and r[4] <= newest for r in rows
+            )
+            if len(page) < length or caught_up:
+                break
+            start += length
+
+        self.conn.execute(
+            "INSERT OR IGNORE INTO synced (user_id, media_type) VALUES (?, ?)", (user_id, media_type)
+        )
+        self.conn.commit()
+        return live
+
+    def recent(self, user_id, media_type, limit, extra=()):
+        """Return `[(title, watched_at)]` – the *limit* most recent distinct titles."""
+        rows = self.conn.execute(
+            """SELECT title, MAX(watched_at) AS last FROM history
+               WHERE user_id = ? AND media_type = ? AND title IS NOT NULL
+               GROUP BY title ORDER BY last DESC LIMIT ?""",
+            (user_id, media_type, limit),
+        ).fetchall()
+        latest = dict(rows)
+        for title, ts in extra:
+            if title is not None and (ts or 0) > (latest.get(title) or 0):
+                latest[title] = ts
+        return sorted(latest.items(), key=lambda r: r[1] or 0, reverse=True)[:limit]
+
+
 def get_recently_watched(user_id=None, username=None, limit=10, media_type="movie"):
     """
     media_type: one of 'movie' or 'episode' (for show)
     Returns a DataFrame of the user's most recently watched movies (title, watched_at).
+
+    History is served from a local mirror that is brought up to date with a
+    small delta request first, so heavy users don't re-download years of rows.
     """
     if username is None:
         print("Needs a username")
         return
-    # 1) Resolve user_id if not provided
-    if user_id is None:
-        resp = get_tautulli_data("get_users")
-        users = resp.get("response", {}).get("data", resp)
-        if isinstance(users, dict):
-            users = [users]
-        user = next((u for u in users if u.get("username") == username), users[0])
-        user_id = user.get("user_id")
-
-    # 2) Fetch history sorted by date descending
-    resp = get_tautulli_data(
-        "get_history",
-        user_id=user_id,
-        media_type=media_type,
-        # length=limit,
-        order_column="date",
-        order_dir="desc"
-    )
-    data = resp.get("response", {}).get("data", resp)
+    mirror = HistoryMirror()
+    try:
+        # 1) Resolve user_id if not provided (cached map)
+        if user_id is None:
+            user_id = mirror.user_id(username)
 
-    # Unwrap v2 history payload: data may be dict with 'data' list, or list directly
-    if isinstance(data, dict) and "data" in data:
-        history = data["data"]
-    elif isinstance(data, list):
-        history = data
-    else:
-        history = []
-
-    # 3) Build list of recent watches
-    records = []
-    for entry in history:
-        ts = entry.get("date") or entry.get("timestamp") or entry.get("watched_at")
-        try:
-            watched_at = datetime.fromtimestamp(int(ts))
-        except Exception:
-            watched_at = None
-        if (media_type == "movie"):
-            title = entry.get("title") or entry.get("full_title")
-        else:
-            title = entry.get("grandparent_title")
-        records.append({
-            "title": title,
-            "watched_at": watched_at
-        })
-
-    # 4) Return DataFrame of the most recent N
-    df = pd.DataFrame(records)
-    if (df.empty):
+        # 2) Pull rows newer than the mirror's newest
+        with metrics.stage("history_sync"):
+            live = mirror.sync(user_id, media_type)
+
+        # 3) Most recent N distinct titles, straight from the index
+        recent = mirror.recent(user_id, media_type, limit, extra=live)
+    finally:
+        mirror.close()
+
+    records = [
+        {"title": title, "watched_at": datetime.fromtimestamp(ts) if ts is not None else None}
+        for title, ts in recent
+    ]
+    if not records:
         return pd.DataFrame(columns=["title", "watched_at"])
-    recent_shows = (
-        df.groupby("title", as_index=False)["watched_at"]
-        .max()
-        .sort_values("watched_at", ascending=False)
-        .head(limit)
-    )
-    return recent_shows
+    return pd.DataFrame(records)
 
 
 if __name__ == "__main__":
     recent5 = get_recently_watched(limit=10, media_type="episode")
-    print("Most Recently Watched Movies:\n", recent5)
\ No newline at end of file
+    print("Most Recently Watched Movies:\n", recent5)
@@ -1,8 +1,7 @@
-import argparse
 import json, os, sys, pathlib, logging
 from datetime import datetime
-from tautulli import get_recently_watched
-from plex_playlist import push_recs
+from webhook_client import get_payload
+import metrics
 
 LOG_PATH = pathlib.Path(os.getenv("TAUTULLI_WEBHOOK_LOG", "/config/plex_reccomendation/logs/tautulli.log"))
 LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -17,56 +16,57 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
-def _get_payload() -> dict:
-    """Return a dict describing the event, using whichever mechanism is available."""
-
-    # 1. Preferred: full JSON passed via env var ("{payload}" in Arguments)
-    raw = os.environ.get("TAUTULLI_PAYLOAD")
-    if raw:
-        log.debug("Using JSON payload from env var (len=%d)", len(raw))
-        try:
-            return json.loads(raw)
-        except Exception as e:
-            log.warning("Failed to parse TAUTULLI_PAYLOAD: %s", e)
-
-    # 2. Fallback: parse individual CLI arguments inserted by Tautulli variables
-    p = argparse.ArgumentParser(description="Tautulli custom webhook")
-    p.add_argument("--action")
-    p.add_argument("--media_type")
-    p.add_argument("--username")
-    p.add_argument("--title", required=False)
-    # allow unknown so we ignore extra placeholders
-    args, _unknown = p.parse_known_args()
-
-    if not args.action:
-        return {}
-
-    return {
-        "event": args.action,
-        "media_type": args.media_type,
-        "username": args.username,
-        "title": args.title,
-    }
+# run by Tautulli, which kills the script about 30 s in – cache rebuilds
+# must not run inside this process (see rec_engine.refresh)
+_ONE_SHOT = False
 
 def main():
-    payload = _get_payload()
-    log.info("Received payload: %s", json.dumps(payload)[:400])
+    global _ONE_SHOT
+    _ONE_SHOT = True
+    process(get_payload())
 
+def event_key(payload: dict):
+    """Return `(user, kind)` for events that need new recs, else ``None``."""
     if payload.get("event") not in ("watched", "playback_stop", "stop"):
+        return None
+    kind = "tv" if payload["media_type"] == "episode" else "movie"
+    return payload["username"], kind
+
+def process(payload: dict):
+    """Handle one Tautulli event (also called by the resident service)."""
+    log.info("Received payload: %s", json.dumps(payload)[:400])
+
+    key = event_key(payload)
+    if key is None:
         log.info("Ignoring event %s", payload.get("event"))
         return
 
-    kind = "tv" if payload["media_type"] == "episode" else "movie"
-    user = payload["username"]
+    user, kind = key
     log.info("Processing: user=%s kind=%s", user, kind)
 
-    recent = get_recently_watched(username=user, media_type=payload["media_type"], limit=10)
+    before = metrics.snapshot()
+    try:
+        with metrics.profiled(f"event-{user}-{kind}"):
+            _push_for(user, kind, payload["media_type"])
+    finally:
+        log.info("metrics %s", metrics.summary_line(before, event=payload.get("event"), user=user, kind=kind))
+
+def _push_for(user: str, kind: str, media_type: str):
+    # imported only for events we act on – ignored events never load
+    # pandas / plexapi / the model
+    from tautulli import get_recently_watched
+    from plex_playlist import push_recs
+    import rec_engine
+
+    rec_engine.DETACH_REFRESH = rec_engine.DETACH_REFRESH or _ONE_SHOT
+
+    recent = get_recently_watched(username=user, media_type=media_type, limit=10)
     if recent.empty:
         log.warning("No recent items found for user=%s", user)
         return
 
     log.info("Recently watched: %s", recent["title"].tolist())
-    push_recs(user, recent["title"].tolist(), kind)
+    push_recs(user, recent["title"].tolist(), kind, watched_at=recent["watched_at"].tolist())
     log.info("Finished push_recs for %s (%d items)", user, len(recent))
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+# tmdb_catalog.py
+# Out-of-library candidate index built from TMDB's daily id exports.
+#
+# The export (e.g. movie_ids_10_17_2026.json.gz) is streamed line by line in
+# fixed-size chunks; each chunk is joined against detail rows (from a local
+# dump and/or TMDB), featurized with the library's frozen FeatureSpace and
+# written as one part file, so memory stays bounded by the chunk size.
+import argparse
+import gzip
+import json
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+import joblib
+import pandas as pd
+import scipy.sparse as sp
+
+from gen_recs import Movie, TVShow
+from tmdb_client import get_client
+from tmdb_store import MetaStore
+from vector_index import BruteForceIndex
+from vector_store import open_matrix, save_matrix
+
+_CACHE = Path("plex_rec_cache")
+_CHUNK = 5000                            # export lines per part file
+
+
+def _open(path: Path):
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _lines(path: Path) -> Iterator[dict]:
+    """Yield one JSON object per non-empty line of a (gzipped) JSONL file."""
+    with _open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_export(path: Path, min_popularity: float = 0.0,
+                include_adult: bool = False) -> Iterator[dict]:
+    """Stream entries of a TMDB daily id export, filtered by popularity / adult."""
+    for entry in _lines(path):
+        if entry.get("adult") and not include_adult:
+            continue
+        if (entry.get("popularity") or 0) < min_popularity:
+            continue
+        yield entry
+
+
+def _store_kind(kind: str) -> str:
+    # own namespace, so library prunes never touch catalog rows
+    return f"catalog_{kind}"
+
+
+def _detail_row(parser, body: dict) -> dict:
+    """Metadata row for one TMDB detail body, with its (en-US) title."""
+    return {**parser.parse(body), "title": body.get("title") or body.get("name") or ""}
+
+
+def load_details(kind: str, path: Path, store: MetaStore, chunk: int = _CHUNK) -> int:
+    """Stream a local detail dump into the metadata store; return rows loaded.
+
+    The dump holds one TMDB detail body per line, as returned by
+    `/movie/{id}?append_to_response=credits` or
+    `/tv/{id}?append_to_response=credits,season/1`.
+    """
+    parser = Movie() if kind == "movie" else TVShow()
+    loaded = 0
+    for bodies in _chunks(_lines(path), chunk):
+        rows = {
+            f"tmdb:{b['id']}": _detail_row(parser, b)
+            for b in bodies if "id" in b
+        }
+        store.put_many(_store_kind(kind), rows)
+        loaded += len(rows)
+    return loaded
+
+
+class Catalog:
+    """On-disk candidate index for one *kind*, kept apart from the library.
+
+    Layout under ``plex_rec_cache/catalog/<kind>/``:
+
+    • ``space.joblib``        – the FeatureSpace every part was built with
+    • ``state.json``          – export name, popularity filter + entries consumed (for resuming)
+    • ``part-NNNNN.vec``      – CSR vectors of one chunk (memory-mapped)
+    • ``part-NNNNN.parquet``  – key / title / popularity of the same rows
+    """
+
+    def __init__(self, kind: str, root: Path = _CACHE / "catalog"):
+        self.kind = kind
+        self.dir = Path(root) / kind
+
+    def exists(self) -> bool:
+        return (self.dir / "space.joblib").exists() and bool(self.parts())
+
+    def parts(self) -> List[Path]:
+        return sorted(self.dir.glob("part-*.vec"))
+
+    def space(self):
+        return joblib.load(self.dir / "space.joblib")
+
+    def state(self) -> dict:
+        try:
+            return json.loads((self.dir / "state.json").read_text())
+        except FileNotFoundError:
+            return {}
+
+    def reset(self, space, export: str, min_popularity: float = 0.0):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.dir.mkdir(parents=True)
+        joblib.dump(space, self.dir / "space.joblib")
+        self._save_state({"export": export, "min_popularity": min_popularity, "lines": 0})
+
+    def _save_state(self, state: dict):
+        (self.dir / "state.json").write_text(json.dumps(state))
+
+    def append(self, meta: pd.DataFrame, X: sp.csr_matrix, lines: int):
+        """Write one part and advance the resume marker by *lines*."""
+        stem = self.dir / f"part-{len(self.parts()):05d}"
+        meta.reset_index(drop=True).to_parquet(stem.with_suffix(".parquet"))
+        save_matrix(stem.with_suffix(".vec"), X)
+        self.advance(lines)
+
+    def advance(self, lines: int):
+        state = self.state()
+        state["lines"] = state.get("lines", 0) + lines
+        self._save_state(state)
+
+    def recommend(self, Q: sp.csr_matrix, seeds: List[str], exclude_keys=(),
+                  n: int = 5, top_n: int = 25) -> pd.DataFrame:
+        """Return `(title, score, seed, key)` for the best catalog hits.
+
+        *Q* holds one row per seed, transformed with this catalog's `space()`.
+        Parts are mapped and scanned one at a time, so memory stays bounded.
+        """
+        exclude_keys = set(exclude_keys)
+        hits = []
+        for part in self.parts():
+            X = open_matrix(part)
+            meta = pd.read_parquet(part.with_suffix(".parquet"), columns=["key", "title"])
+            exclude = meta["key"].isin(exclude_keys).values
+            ids, scores = BruteForceIndex().fit(X).search(Q, n, exclude=exclude)
+            for qi, seed in enumerate(seeds):
+                for i, score in zip(ids[qi], scores[qi]):
+                    if i >= 0:
+                        hits.append((meta["title"].iat[i], float(score), seed, meta["key"].iat[i]))
+
+        out = pd.DataFrame(hits, columns=["title", "score", "seed", "key"])
+        return (
+            out.sort_values("score", ascending=False, kind="stable")
+            .groupby("seed", sort=False).head(n)
+            .drop_duplicates("title", keep="first")
+            .head(top_n)
+            .reset_index(drop=True)
+        )
+
+
+def ingest(kind: str, export: Path, space, *, details: Optional[Path] = None,
+           fetch_missing: bool = False, min_popularity: float = 0.0,
+           chunk: int = _CHUNK, reset: bool = False) -> int:
+    """Stream *export* into the catalog index for *kind*; return rows added.
+
+    • *details*       – optional local dump loaded into the store first.
+    • *fetch_missing* – enrich ids absent from the store through TMDB
+      (rate-limited, cached in the store for the next run).
+    • Re-running with the same export resumes after the last written part;
+      a different export or *min_popularity* (or *reset*) starts the catalog
+      over, since the resume marker counts entries that passed the filter.
+    """
+    export = Path(export)
+    catalog = Catalog(kind)
+    state = catalog.state()
+    if (reset or state.get("export") != export.name or state.get("min_popularity") != min_popularity
+            or not (catalog.dir / "space.joblib").exists()):
+        catalog.reset(space, export.name, min_popularity)
+        state = catalog.state()
+    space = catalog.space()          # resumed parts must share one space
+    skip = state.get("lines", 0)
+
+    store = MetaStore(_CACHE / "tmdb_meta.sqlite")
+    added = 0
+    try:
+        if details:
+            load_details(kind, details, store)
+        enricher = Movie() if kind == "movie" else TVShow()
+        title_field = "original_title" if kind == "movie" else "original_name"
+
+        entries = iter_export(export, min_popularity)
+        for _ in zip(range(skip), entries):
+            pass                     # already ingested on a previous run
+
+        for batch in _chunks(entries, chunk):
+            by_key = {f"tmdb:{e['id']}": e for e in batch}
+            have = store.get_many(_store_kind(kind), by_key)
+            if fetch_missing:
+                fetched = {
+                    key: _detail_row(enricher, body)
+                    for key, body in get_client().map(
+                        enricher.fetch_one, [k for k in by_key if k not in have])
+                    if body is not None               # gone from TMDB since the export
+                }
+                for key, row in fetched.items():
+                    row["title"] = row["title"] or by_key[key].get(title_field) or ""
+                store.put_many(_store_kind(kind), fetched)
+                have.update(fetched)
+
+            rows = [{**have[k], "key": k, "popularity": by_key[k].get("popularity") or 0}
+                    for k in by_key if k in have]
+            if rows:
+                frame = pd.DataFrame(rows)
+                frame["title"] = frame["title"].fillna("")
+                catalog.append(frame[["key", "title", "popularity"]],
+                               space.transform(frame), len(batch))
+                added += len(rows)
+            else:
+                catalog.advance(len(batch))
+    finally:
+        store.close()
+    return added
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Ingest a TMDB daily id export into the catalog index")
+    p.add_argument("kind", choices=["movie", "tv"])
+    p.add_argument("export", help="e.g. movie_ids_10_17_2026.json.gz")
+    p.add_argument("--details", help="JSONL(.gz) dump of TMDB detail bodies")
+    p.add_argument("--fetch-missing", action="store_true", help="enrich ids missing from the store via TMDB")
+    p.add_argument("--min-popularity", type=float, default=0.0)
+    p.add_argument("--chunk", type=int, default=_CHUNK)
+    p.add_argument("--reset", action="store_true")
+    args = p.parse_args()
+
+    from rec_engine import feature_space
+    n = ingest(args.kind, args.export, feature_space(args.kind), details=args.details,
+               fetch_missing=args.fetch_missing, min_popularity=args.min_popularity,
+               chunk=args.chunk, reset=args.reset)
+    print(f"Ingested {n} {args.kind} titles into {Catalog(args.kind).dir}")
@@ -0,0 +1,135 @@
+# tmdb_client.py
+# Shared TMDB HTTP client: pooled keep-alive session, token-bucket rate
+# limit, retries on 429/5xx and a thread pool for concurrent enrichment.
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv(override=True)
+
+TMDB_API_KEY = os.getenv("TMDB_TOKEN")
+TMDB_BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "40"))   # requests / second
+TMDB_WORKERS = int(os.getenv("TMDB_WORKERS", "8"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: *rate* tokens per second, *burst* capacity."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until one token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class NotFound(requests.HTTPError):
+    """TMDB has no such title (404)."""
+
+
+class TMDBClient:
+    """Rate-limited TMDB client shared by the movie and TV enrichers.
+
+    • `get` retries 429 and 5xx responses with exponential backoff,
+      honouring `Retry-After` when TMDB sends one. Any other error status
+      raises – `NotFound` for a 404 – so an error body never passes for data.
+    • `map` runs a function over many items on a bounded thread pool and
+      yields `(item, result)` pairs as they complete.
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key: Optional[str] = TMDB_API_KEY, *,
+                 base_url: str = TMDB_BASE_URL,
+                 rate: float = TMDB_RATE_LIMIT,
+                 workers: int = TMDB_WORKERS,
+                 retries: int = 5,
+                 backoff: float = 0.5,
+                 timeout: float = 10.0):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        metrics.instrument(self.session)
+
+    def get(self, path: str, **params) -> dict:
+        """GET *path* and return the decoded JSON body."""
+        params["api_key"] = self.api_key
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                resp = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            if resp.status_code in self.RETRY_STATUS and attempt < self.retries:
+                retry_after = resp.headers.get("Retry-After")
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = self.backoff * 2 ** attempt
+                time.sleep(delay)
+                continue
+            if resp.status_code == 404:
+                raise NotFound(f"404 Not Found: {path}", response=resp)
+            # 401 / 403 (bad or rotated key) and the rest fail the whole run
+            resp.raise_for_status()
+            return resp.json()
+
+    def map(self, fn: Callable, items: Iterable) -> Iterator[Tuple[object, object]]:
+        """Yield `(item, fn(item))` for every item, in completion order."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(fn, item): item for item in items}
+            try:
+                for fut in as_completed(futures):
+                    yield futures[fut], fut.result()
+            finally:
+                for fut in futures:
+                    fut.cancel()
+
+
+_client: Optional[TMDBClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> TMDBClient:
+    """Return the process-wide `TMDBClient`, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TMDBClient()
+        return _client
@@ -0,0 +1,99 @@
+# tmdb_store.py
+# Durable per-title TMDB metadata, so rebuilds only enrich what changed.
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# enriched rows older than this are fetched again on the next build
+META_TTL_DAYS = float(os.getenv("TMDB_META_TTL_DAYS", "30"))
+
+
+def meta_key(row) -> str:
+    """Return the store key for a library row: ``tmdb:<id>`` or ``tvdb:<id>``.
+
+    `fetch_plex_list` yields either a `tmdb_id` or (for some shows) only a
+    `tvdb_id`, so both id spaces share one table with a prefix.
+    """
+    tmdb_id = row.get("tmdb_id")
+    if isinstance(tmdb_id, str) and tmdb_id:
+        return f"tmdb:{tmdb_id}"
+    tvdb_id = row.get("tvdb_id")
+    if isinstance(tvdb_id, str) and tvdb_id:
+        return f"tvdb:{tvdb_id}"
+    raise ValueError(f"Row has neither tmdb_id nor tvdb_id: {dict(row)!r}")
+
+
+class MetaStore:
+    """SQLite table of enriched rows keyed by ``(kind, key)``.
+
+    Every row carries a `fetched_at` timestamp; `get_many` only returns rows
+    younger than *max_age_days* so expired titles get re-enriched.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # several webhook processes may hit the store at once
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS meta (
+                   kind       TEXT NOT NULL,
+                   key        TEXT NOT NULL,
+                   row        TEXT NOT NULL,
+                   fetched_at REAL NOT NULL,
+                   PRIMARY KEY (kind, key)
+               )"""
+        )
+        self.conn.commit()
+
+    def get_many(self, kind: str, keys: Iterable[str],
+                 max_age_days: float = META_TTL_DAYS) -> Dict[str, dict]:
+        """Return ``{key: row}`` for every *fresh* key found in the store."""
+        cutoff = time.time() - max_age_days * 86400
+        wanted = list(dict.fromkeys(keys))
+        found: Dict[str, dict] = {}
+        # stay well under SQLite's bound-parameter limit
+        for i in range(0, len(wanted), 500):
+            chunk = wanted[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            cur = self.conn.execute(
+                f"SELECT key, row FROM meta WHERE kind = ? AND fetched_at >= ? AND key IN ({marks})",
+                [kind, cutoff, *chunk],
+            )
+            for key, row in cur:
+                found[key] = json.loads(row)
+        return found
+
+    def put_many(self, kind: str, rows: Dict[str, dict]):
+        """Insert or refresh *rows* and commit (one checkpoint)."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta (kind, key, row, fetched_at) VALUES (?, ?, ?, ?)",
+            [(kind, key, json.dumps(row), now) for key, row in rows.items()],
+        )
+        self.conn.commit()
+
+    def prune(self, kind: str, keep: Iterable[str]) -> int:
+        """Drop every *kind* row whose key is not in *keep*; return count."""
+        keep = set(keep)
+        stale: List[str] = [
+            k for (k,) in self.conn.execute("SELECT key FROM meta WHERE kind = ?", (kind,))
+            if k not in keep
+        ]
+        self.conn.executemany(
+            "DELETE FROM meta WHERE kind = ? AND key = ?",
+            [(kind, k) for k in stale],
+        )
+        self.conn.commit()
+        return len(stale)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,97 @@
+# user_profile.py
+# One taste vector per (user, kind): the recency-weighted sum of the feature
+# rows of everything the user watched, so a recommendation is a single
+# similarity query instead of one query per recent title.
+#
+# Weights halve every PROFILE_HALF_LIFE_DAYS. The vector is kept relative to
+# the newest watch (`as_of`), so folding in a new watch is one O(d) decay +
+# add; decay between watches and "now" scales every entry alike and doesn't
+# change the cosine direction, so it is never applied at query time.
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+PROFILE_HALF_LIFE_DAYS = float(os.getenv("PROFILE_HALF_LIFE_DAYS", "30"))
+
+_PROFILE_DB = Path("plex_rec_cache") / "profiles.sqlite"
+
+
+class Profile:
+    """A user's taste vector in one model's feature space.
+
+    • *model* – id of the fitted feature space the vector lives in.
+    • *as_of* – epoch seconds of the newest watch folded in.
+    • *watched* – item key → last watch time; those titles are never recommended.
+    """
+
+    def __init__(self, model: str, dim: int, as_of: float = 0.0,
+                 vector: Optional[np.ndarray] = None, watched: Optional[Dict[str, float]] = None):
+        self.model = model
+        self.as_of = as_of
+        self.vector = np.zeros(dim, dtype=np.float32) if vector is None else vector
+        self.watched = watched or {}
+
+    def add(self, key: str, row: np.ndarray, watched_at: float,
+            half_life_days: float = PROFILE_HALF_LIFE_DAYS):
+        """Fold one watch of *key* (feature *row*) in at *watched_at* – O(d)."""
+        half_life = half_life_days * 86400
+        if watched_at >= self.as_of:
+            self.vector *= np.float32(0.5 ** ((watched_at - self.as_of) / half_life))
+            self.vector += row
+            self.as_of = watched_at
+        else:                                       # late-arriving older watch
+            self.vector += row * np.float32(0.5 ** ((self.as_of - watched_at) / half_life))
+        self.watched[key] = max(watched_at, self.watched.get(key, 0.0))
+
+
+class ProfileStore:
+    """SQLite table of the latest `Profile` per ``(username, kind)``."""
+
+    def __init__(self, path: Path = _PROFILE_DB):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS profiles (
+                   username   TEXT NOT NULL,
+                   kind       TEXT NOT NULL,
+                   model      TEXT NOT NULL,
+                   as_of      REAL NOT NULL,
+                   vector     BLOB NOT NULL,
+                   watched    TEXT NOT NULL,
+                   updated_at REAL NOT NULL,
+                   PRIMARY KEY (username, kind)
+               )"""
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, username: str, kind: str) -> Optional[Profile]:
+        row = self.conn.execute(
+            "SELECT model, as_of, vector, watched FROM profiles WHERE username = ? AND kind = ?",
+            (username, kind),
+        ).fetchone()
+        if row is None:
+            return None
+        vector = np.frombuffer(row[2], dtype=np.float32).copy()
+        return Profile(row[0], vector.size, row[1], vector, json.loads(row[3]))
+
+    def put(self, username: str, kind: str, profile: Profile):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO profiles (username, kind, model, as_of, vector, watched, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (username, kind, profile.model, profile.as_of,
+             profile.vector.astype(np.float32).tobytes(), json.dumps(profile.watched), time.time()),
+        )
+        self.conn.commit()
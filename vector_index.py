@@ -0,0 +1,236 @@
+# vector_index.py
+# Pluggable cosine nearest-neighbour indexes over the unit-norm item matrix.
+#
+#   brute – exact: one sparse product against every row
+#   ivf   – approximate: spherical k-means buckets, only `nprobe` of the
+#           `nlist` buckets are scanned per query
+#
+# Both only need NumPy/SciPy and serialize to a small .npz next to X.
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "brute").lower()
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))        # 0 → ~sqrt(n_items)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+
+_BLOCK = 4096   # rows per block when assigning rows to centroids
+
+
+def _top_k(S: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise top-*k* of a dense score block, best first."""
+    k = min(k, S.shape[1])
+    if k <= 0:
+        empty = np.empty((S.shape[0], 0))
+        return empty.astype(np.intp), empty.astype(np.float32)
+    part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(S, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def _pad(ids: np.ndarray, scores: np.ndarray, k: int):
+    """Right-pad result rows to width *k* with id -1 / score -inf."""
+    if ids.shape[1] >= k:
+        return ids, scores
+    fill = k - ids.shape[1]
+    ids = np.hstack([ids, np.full((ids.shape[0], fill), -1, dtype=np.intp)])
+    scores = np.hstack([scores, np.full((scores.shape[0], fill), -np.inf, dtype=np.float32)])
+    return ids, scores
+
+
+class BruteForceIndex:
+    """Exact cosine search: every query is scored against every row."""
+
+    backend = "brute"
+
+    def fit(self, X: sp.csr_matrix):
+        self.X = X
+        return self
+
+    def extend(self, X: sp.csr_matrix):
+        """Index the grown matrix *X* (rows appended at the end)."""
+        self.X = X
+        return self
+
+    def search(self, Q, k: int, exclude: Optional[np.ndarray] = None):
+        """Return `(ids, scores)` of shape (n_queries, k), best first.
+
+        *exclude* is a boolean mask over rows that must never be returned
+        (tombstones); missing slots are padded with id -1 / score -inf.
+        """
+        S = np.asarray((Q @ self.X.T).todense(), dtype=np.float32)
+        if exclude is not None:
+            S[:, exclude] = -np.inf
+        ids, scores = _top_k(S, k)
+        scores = scores.astype(np.float32)
+        ids[~np.isfinite(scores)] = -1
+        return _pad(ids, scores, k)
+
+    def save(self, path: Path):
+        np.savez(path, backend=self.backend, params=json.dumps({}))
+
+
+class IVFIndex(BruteForceIndex):
+    """Inverted-file index: rows are bucketed under spherical k-means
+    centroids and a query only scans its *nprobe* closest buckets.
+
+    • *nlist*  – number of buckets (0 → about sqrt(n_items)).
+    • *nprobe* – buckets scanned per query; higher = better recall, slower.
+    • *iters*  – k-means iterations at fit time.
+    """
+
+    backend = "ivf"
+
+    def __init__(self, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+                 iters: int = 10, seed: int = 42):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iters = iters
+        self.seed = seed
+
+    def _assign(self, X: sp.csr_matrix) -> np.ndarray:
+        out = np.empty(X.shape[0], dtype=np.intp)
+        for start in range(0, X.shape[0], _BLOCK):
+            block = X[start:start + _BLOCK] @ self.centroids.T
+            out[start:start + _BLOCK] = np.asarray(block).argmax(axis=1)
+        return out
+
+    def _bucket(self, assign: np.ndarray):
+        self.assign = assign
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.order], np.arange(self.centroids.shape[0] + 1))
+
+    def fit(self, X: sp.csr_matrix):
+        self.X = X
+        n = X.shape[0]
+        nlist = self.nlist or int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(self.seed)
+        self.centroids = X[rng.choice(n, nlist, replace=False)].toarray()
+
+        for _ in range(self.iters):
+            assign = self._assign(X)
+            members = sp.csr_matrix(
+                (np.ones(n, dtype=np.float32), (assign, np.arange(n))), shape=(nlist, n)
+            )
+            sums = np.asarray((members @ X).todense(), dtype=np.float32)
+            norms = np.linalg.norm(sums, axis=1)
+            # keep the old centroid for buckets that ended up empty
+            live = norms > 0
+            self.centroids[live] = sums[live] / norms[live, None]
+        self._bucket(self._assign(X))
+        return self
+
+    def extend(self, X: sp.csr_matrix):
+        """Bucket the rows appended to *X* under the existing centroids."""
+        new = self._assign(X[len(self.assign):])
+        self.X = X
+        self._bucket(np.concatenate([self.assign, new]))
+        return self
+
+    def search(self, Q, k: int, exclude: Optional[np.ndarray] = None):
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        probes = _top_k(np.asarray(Q @ self.centroids.T), nprobe)[0]
+        all_ids, all_scores = [], []
+        for qi in range(Q.shape[0]):
+            cand = np.concatenate([
+                self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes[qi]
+            ])
+            if exclude is not None:
+                cand = cand[~exclude[cand]]
+            S = np.asarray((Q[qi] @ self.X[cand].T).todense(), dtype=np.float32)
+            local, scores = _top_k(S, k)
+            ids, scores = _pad(cand[local], scores.astype(np.float32), k)
+            all_ids.append(ids)
+            all_scores.append(scores)
+        return np.vstack(all_ids), np.vstack(all_scores)
+
+    def save(self, path: Path):
+        params = {"nlist": self.nlist, "nprobe": self.nprobe,
+                  "iters": self.iters, "seed": self.seed}
+        np.savez(path, backend=self.backend, params=json.dumps(params),
+                 centroids=self.centroids, assign=self.assign)
+
+
+_BACKENDS = {"brute": BruteForceIndex, "ivf": IVFIndex}
+
+
+def make_index(backend: str = INDEX_BACKEND, **params):
+    """Return an unfitted index for *backend* ('brute' | 'ivf')."""
+    try:
+        return _BACKENDS[backend](**params)
+    except KeyError:
+        raise ValueError(f"Unknown index backend {backend!r}; pick one of {sorted(_BACKENDS)}")
+
+
+def load_index(path: Path, X: sp.csr_matrix):
+    """Load an index saved by `save` and bind it to the item matrix *X*."""
+    with np.load(path) as data:
+        index = make_index(str(data["backend"]), **json.loads(str(data["params"])))
+        index.X = X
+        if index.backend == "ivf":
+            index.centroids = data["centroids"]
+            index._bucket(data["assign"])
+    return index
+
+
+def recall_report(X: sp.csr_matrix, k: int = 10, n_queries: int = 200,
+                  nlists=(0,), nprobes=(1, 4, 8, 16, 32), seed: int = 0) -> list:
+    """Measure IVF recall@k and latency against the exact brute-force index.
+
+    Returns one dict per (nlist, nprobe) setting, plus a brute baseline row.
+    """
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(X.shape[0], min(n_queries, X.shape[0]), replace=False)
+    Q = X[queries]
+
+    brute = BruteForceIndex().fit(X)
+    t0 = time.perf_counter()
+    truth, _ = brute.search(Q, k)
+    brute_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    report = [{"backend": "brute", "recall": 1.0, "ms_per_query": round(brute_ms, 3)}]
+
+    for nlist in nlists:
+        t0 = time.perf_counter()
+        ivf = IVFIndex(nlist=nlist).fit(X)
+        fit_s = time.perf_counter() - t0
+        for nprobe in nprobes:
+            ivf.nprobe = nprobe
+            t0 = time.perf_counter()
+            got, _ = ivf.search(Q, k)
+            ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            hits = sum(len(set(g[g >= 0]) & set(t[t >= 0])) for g, t in zip(got, truth))
+            report.append({
+                "backend": "ivf",
+                "nlist": ivf.centroids.shape[0],
+                "nprobe": nprobe,
+                "recall": round(float(hits / max(1, (truth >= 0).sum())), 4),
+                "ms_per_query": round(ms, 3),
+                "fit_s": round(fit_s, 2),
+            })
+    return report
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="IVF recall@k report against brute force")
+    p.add_argument("matrix", help="item matrix, e.g. plex_rec_cache/movie/gen-…/movie-1_X.vec")
+    p.add_argument("-k", type=int, default=10)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--nlist", type=int, nargs="+", default=[0])
+    p.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = p.parse_args()
+
+    from vector_store import open_matrix
+    X = open_matrix(args.matrix)
+    for row in recall_report(X, args.k, args.queries, args.nlist, args.nprobe):
+        print(json.dumps(row))
@@ -0,0 +1,83 @@
+# vector_store.py
+# Fixed-layout on-disk CSR matrix, opened read-only with memory mapping so
+# concurrent processes share one copy in the page cache and "loading" is
+# just mapping the file, whatever the library size.
+#
+#   [0, 4096)   header: magic, uint32 length, JSON {shape, arrays: {...}}
+#   then        data (float32), indices, indptr – each 64-byte aligned
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+
+MAGIC = b"PLXVEC01"
+_HEADER = 4096
+_ALIGN = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def save_matrix(path: Path, X) -> None:
+    """Write *X* (any sparse matrix) to *path* in the fixed layout.
+
+    The file is written next to *path* and renamed into place, so readers
+    never map a half-written matrix.
+    """
+    path = Path(path)
+    X = sp.csr_matrix(X)
+    # int32 indices whenever they fit, so scipy wraps the maps without a copy
+    idx = np.int32 if max(X.nnz, X.shape[1]) < 2 ** 31 else np.int64
+    arrays = {
+        "data": X.data.astype(np.float32, copy=False),
+        "indices": X.indices.astype(idx, copy=False),
+        "indptr": X.indptr.astype(idx, copy=False),
+    }
+
+    layout, offset = {}, _HEADER
+    for name, arr in arrays.items():
+        offset = _align(offset)
+        layout[name] = {"offset": offset, "dtype": arr.dtype.str, "length": int(arr.size)}
+        offset += arr.nbytes
+    header = json.dumps({"shape": list(X.shape), "arrays": layout}).encode()
+    if len(MAGIC) + 4 + len(header) > _HEADER:
+        raise ValueError("vector store header does not fit in its reserved block")
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(len(header).to_bytes(4, "little"))
+        fh.write(header)
+        for name, arr in arrays.items():
+            fh.seek(layout[name]["offset"])
+            arr.tofile(fh)
+        fh.truncate(offset)
+    os.replace(tmp, path)
+
+
+def open_matrix(path: Path) -> sp.csr_matrix:
+    """Map the matrix at *path* read-only and wrap it as a CSR matrix."""
+    path = Path(path)
+    with open(path, "rb") as fh:
+        head = fh.read(_HEADER)
+    if head[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a vector store file")
+    size = int.from_bytes(head[len(MAGIC):len(MAGIC) + 4], "little")
+    meta = json.loads(head[len(MAGIC) + 4:len(MAGIC) + 4 + size])
+
+    arrays = {}
+    for name, spec in meta["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        if spec["length"] == 0:
+            arrays[name] = np.empty(0, dtype=dtype)     # mmap refuses empty maps
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r",
+                                     offset=spec["offset"], shape=(spec["length"],))
+    return sp.csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=tuple(meta["shape"]),
+        copy=False,
+    )
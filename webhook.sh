@@ -4,6 +4,21 @@ set -eu
 
 SCRIPTS_DIR="$(dirname "$0")"
 echo $SCRIPTS_DIR
+
+if [ -f "$SCRIPTS_DIR/.env" ]; then
+    # shellcheck source=/dev/null
+    . "$SCRIPTS_DIR/.env"
+fi
+
+# Resident service running (python rec_service.py)? Hand the event over and
+# exit – no venv check, no heavy imports. Falls through if it is unreachable.
+if [ -n "${RECS_SERVICE_URL:-}" ]; then
+    if RECS_SERVICE_URL="$RECS_SERVICE_URL" python3 "$SCRIPTS_DIR/webhook_client.py" "$@"; then
+        exit 0
+    fi
+    echo "[webhook] falling back to running the event inline"
+fi
+
 VENV_DIR="$SCRIPTS_DIR/plex_recs_env"
 echo "venv dir: $VENV_DIR"
 REQ_FILE="$SCRIPTS_DIR/requirements.txt"
@@ -38,9 +53,4 @@ if [ ! -f "$STAMP" ] || [ "$REQ_FILE" -nt "$STAMP" ]; then
     touch "$STAMP"
 fi
 
-if [ -f "$SCRIPTS_DIR/.env" ]; then
-    # shellcheck source=/dev/null
-    . "$SCRIPTS_DIR/.env"
-fi
-
 exec "$PYTHON_DIR/python" "$SCRIPTS_DIR/tautulli_webhook.py" "$@"
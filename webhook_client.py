@@ -0,0 +1,80 @@
+# webhook_client.py
+# Thin Tautulli client: turn the script arguments into an event payload and
+# POST it to the resident service (rec_service.py). Standard library only,
+# so it starts instantly without the venv.
+#
+# Exit codes: 0 = accepted by the service, 1 = nothing to send,
+#             2 = service unreachable (webhook.sh then runs the event inline)
+import argparse
+import json
+import logging
+import os
+import sys
+import urllib.error
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+RECS_SERVICE_URL = os.getenv("RECS_SERVICE_URL", "http://127.0.0.1:8765")
+
+
+def get_payload(argv=None) -> dict:
+    """Return a dict describing the event, using whichever mechanism is available."""
+
+    # 1. Preferred: full JSON passed via env var ("{payload}" in Arguments)
+    raw = os.environ.get("TAUTULLI_PAYLOAD")
+    if raw:
+        log.debug("Using JSON payload from env var (len=%d)", len(raw))
+        try:
+            return json.loads(raw)
+        except Exception as e:
+            log.warning("Failed to parse TAUTULLI_PAYLOAD: %s", e)
+
+    # 2. Fallback: parse individual CLI arguments inserted by Tautulli variables
+    p = argparse.ArgumentParser(description="Tautulli custom webhook")
+    p.add_argument("--action")
+    p.add_argument("--media_type")
+    p.add_argument("--username")
+    p.add_argument("--title", required=False)
+    # allow unknown so we ignore extra placeholders
+    args, _unknown = p.parse_known_args(argv)
+
+    if not args.action:
+        return {}
+
+    return {
+        "event": args.action,
+        "media_type": args.media_type,
+        "username": args.username,
+        "title": args.title,
+    }
+
+
+def post(path: str, body: dict, timeout: float = 5.0) -> dict:
+    """POST *body* as JSON to the service and return its JSON reply."""
+    req = urllib.request.Request(
+        f"{RECS_SERVICE_URL.rstrip('/')}{path}",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read() or b"{}")
+
+
+def main() -> int:
+    payload = get_payload()
+    if not payload:
+        print("[webhook] no event in arguments – nothing to send")
+        return 1
+    try:
+        reply = post("/event", payload)
+    except (urllib.error.URLError, OSError) as exc:
+        print(f"[webhook] service at {RECS_SERVICE_URL} unreachable: {exc}")
+        return 2
+    print(f"[webhook] {reply}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())